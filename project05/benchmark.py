@@ -0,0 +1,105 @@
+import sys
+import time
+from pathlib import Path
+
+import hdl
+import netlist
+
+CHIPS = ['Mux8Way16', 'Add16', 'ALU']
+
+
+def benchmark_simulation(count: int = 1_000_000,
+                         single_vectors: int = 200) -> None:
+    # Bit-sliced evaluation of count vectors at once vs one vector per
+    # evaluation
+    for name in CHIPS:
+        chip = hdl.load_chip(name)
+
+        inputs = hdl.random_inputs(chip, single_vectors)
+        simulator = hdl.Simulator(chip, 1)
+        start = time.perf_counter()
+        for vector in range(single_vectors):
+            simulator.evaluate({pin: [plane >> vector & 1 for plane in planes]
+                                for pin, planes in inputs.items()})
+        elapsed = time.perf_counter() - start
+        print(f'{name}, one vector at a time: '
+              f'{single_vectors / elapsed:,.0f} vectors/s')
+
+        inputs = hdl.random_inputs(chip, count)
+        start = time.perf_counter()
+        outputs = hdl.Simulator(chip, count).evaluate(inputs)
+        elapsed = time.perf_counter() - start
+        print(f'{name}, {count:,} vectors at once: '
+              f'{count / elapsed:,.0f} vectors/s')
+
+        start = time.perf_counter()
+        failures = hdl.verify(chip, inputs, outputs, count)
+        elapsed = time.perf_counter() - start
+        print(f'{name}, checking against the reference model: '
+              f'{elapsed:.2f}s, {len(failures)} failures')
+
+
+def benchmark_flattening(count: int = 100_000) -> None:
+    # Gate counts and throughput of hierarchical vs flattened simulation
+    for name in CHIPS + ['PC', 'RAM8', 'CPU']:
+        chip = hdl.load_chip(name)
+        nands, dffs = netlist.count_primitives(chip)
+        start = time.perf_counter()
+        flat = netlist.flatten(chip, builtins=())
+        elapsed = time.perf_counter() - start
+        print(f'{name}: {nands:,} -> {flat.num_gates:,} Nand gates, '
+              f'{dffs} DFFs, flattened in {elapsed:.3f}s')
+
+        inputs = hdl.random_inputs(chip, count)
+        for label, simulator in [
+                ('hierarchical', hdl.Simulator(chip, count, builtins=())),
+                ('flat', netlist.NetlistSimulator(flat, count))]:
+            start = time.perf_counter()
+            simulator.tick(inputs)
+            elapsed = time.perf_counter() - start
+            print(f'{name}, {label}: {count / elapsed:,.0f} vectors/s')
+
+
+def benchmark_memory(ticks: int = 200) -> None:
+    # Gate-level vs builtin RAM64, then the Hack computer running Mult
+    # with builtin memories
+    chip = hdl.load_chip('RAM64')
+    inputs = {'in': hdl.pack([1234]), 'load': [1], 'address': [0] * 6}
+    for label, builtins in [('gate-level', ()), ('builtin', None)]:
+        simulator = netlist.NetlistSimulator(
+            netlist.compile_chip(chip, builtins=builtins), 1)
+        start = time.perf_counter()
+        for _ in range(ticks):
+            simulator.tick(inputs)
+        elapsed = time.perf_counter() - start
+        print(f'RAM64, {label}: {ticks / elapsed:,.0f} ticks/s')
+
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent
+                           / 'project06'))
+    from assembler import assemble
+    program = (Path(__file__).resolve().parent.parent / 'project04'
+               / 'Mult.asm').read_text()
+    simulator = netlist.NetlistSimulator(
+        netlist.compile_chip(hdl.load_chip('Computer')), 1)
+    simulator.builtin('ROM32K').load_program(assemble(program))
+    memory = simulator.builtin('Memory')
+    memory.poke(0, 7)
+    memory.poke(1, 9)
+    simulator.tick({'reset': [1]})
+    start = time.perf_counter()
+    for _ in range(ticks):
+        simulator.tick({'reset': [0]})
+    elapsed = time.perf_counter() - start
+    print(f'Computer running Mult: {ticks / elapsed:,.0f} cycles/s, '
+          f'7 * 9 = {memory.peek(2)}')
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    benchmark_simulation(count)
+    benchmark_flattening()
+    benchmark_memory()
+
+
+if __name__ == '__main__':
+    main()
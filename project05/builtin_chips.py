@@ -0,0 +1,260 @@
+# builtin_chips.py
+# Word-level replacements for the memory chips.
+#
+# Simulated gate by gate, RAM16K alone is 262,144 DFFs behind thousands
+# of Register and Bit parts. A builtin chip instead keeps its contents
+# in a single array('H'). Like the gate-level simulators it runs count
+# vectors at once, each with its own memory; evaluate() and clock() take
+# and return one list of words per pin.
+#
+# Builtins are used in place of the .hdl chip of the same name; the
+# gate-level chips stay available (pass builtins=() to the simulators)
+# and differential_test() checks that both agree.
+from array import array
+
+
+class RAM:
+    # out = memory[address]; on a clock edge memory[address] = in if load
+    inputs = {'in': 16, 'load': 1, 'address': 3}
+    outputs = {'out': 16}
+    combinational = ('address',)  # the inputs out depends on
+
+    def __init__(self, count: int) -> None:
+        self.count = count
+        self.size = self.memory_size()
+        self.words = array('H', bytes(2 * self.size * count))
+        self.bases = range(0, self.size * count, self.size)
+
+    def memory_size(self) -> int:
+        return 1 << self.inputs['address']
+
+    def evaluate(self, inputs: dict) -> dict:
+        words = self.words
+        return {'out': [words[base + address] for base, address
+                        in zip(self.bases, inputs['address'])]}
+
+    def clock(self, inputs: dict) -> None:
+        words = self.words
+        for base, value, load, address in zip(self.bases, inputs['in'],
+                                              inputs['load'],
+                                              inputs['address']):
+            if load:
+                words[base + address] = value
+
+    def peek(self, address: int, vector: int = 0) -> int:
+        return self.words[self.bases[vector] + address]
+
+    def poke(self, address: int, value: int, vector: int = 0) -> None:
+        self.words[self.bases[vector] + address] = value & 0xFFFF
+
+
+class RAM8(RAM):
+    inputs = {'in': 16, 'load': 1, 'address': 3}
+
+
+class RAM64(RAM):
+    inputs = {'in': 16, 'load': 1, 'address': 6}
+
+
+class RAM512(RAM):
+    inputs = {'in': 16, 'load': 1, 'address': 9}
+
+
+class RAM4K(RAM):
+    inputs = {'in': 16, 'load': 1, 'address': 12}
+
+
+class RAM16K(RAM):
+    inputs = {'in': 16, 'load': 1, 'address': 14}
+
+
+class Screen(RAM):
+    inputs = {'in': 16, 'load': 1, 'address': 13}
+
+
+class Keyboard:
+    # out = code of the key pressed (0 for none), set with press()
+    inputs = {}
+    outputs = {'out': 16}
+    combinational = ()
+
+    def __init__(self, count: int) -> None:
+        self.keys = [0] * count
+
+    def evaluate(self, inputs: dict) -> dict:
+        return {'out': list(self.keys)}
+
+    def clock(self, inputs: dict) -> None:
+        pass
+
+    def press(self, key: int, vector: int = 0) -> None:
+        self.keys[vector] = key
+
+
+class Memory(RAM):
+    # Data memory of the Hack computer, as wired in Memory.hdl:
+    # 0-16383 RAM16K, 16384-24575 the screen, 24576 and above read the
+    # keyboard. Writes with address[14] set go to the screen at
+    # address & 8191.
+    inputs = {'in': 16, 'load': 1, 'address': 15}
+    KEYBOARD = 24576
+
+    def memory_size(self) -> int:
+        return self.KEYBOARD + 1
+
+    def evaluate(self, inputs: dict) -> dict:
+        words = self.words
+        keyboard = self.KEYBOARD
+        return {'out': [words[base + (address if address < keyboard
+                                      else keyboard)]
+                        for base, address in zip(self.bases,
+                                                 inputs['address'])]}
+
+    def clock(self, inputs: dict) -> None:
+        words = self.words
+        for base, value, load, address in zip(self.bases, inputs['in'],
+                                              inputs['load'],
+                                              inputs['address']):
+            if load:
+                if address >= 16384:
+                    address = 16384 + (address & 8191)
+                words[base + address] = value
+
+    def press(self, key: int, vector: int = 0) -> None:
+        self.words[self.bases[vector] + self.KEYBOARD] = key
+
+
+class ROM32K(RAM):
+    # Instruction memory: out = rom[address], loaded with load_program()
+    inputs = {'address': 15}
+
+    def clock(self, inputs: dict) -> None:
+        pass
+
+    def load_program(self, words) -> None:
+        # the same program in every vector
+        program = array('H', words)
+        for base in self.bases:
+            self.words[base:base + len(program)] = program
+
+
+BUILTINS = {
+    'RAM8': RAM8,
+    'RAM64': RAM64,
+    'RAM512': RAM512,
+    'RAM4K': RAM4K,
+    'RAM16K': RAM16K,
+    'Screen': Screen,
+    'Keyboard': Keyboard,
+    'Memory': Memory,
+    'ROM32K': ROM32K,
+}
+
+
+def register_builtin(name: str, builtin) -> None:
+    # Replaces chip name by a word-level class with inputs, outputs,
+    # combinational, evaluate() and clock() like the ones above. Check
+    # it against the chip with differential_test() first.
+    BUILTINS[name] = builtin
+
+
+def random_trace(builtin, count: int, steps: int, seed: int = 0) -> list:
+    # Random inputs for each step. Addresses come from a few per vector
+    # half of the time, so that reads see earlier writes.
+    import random
+    generator = random.Random(seed)
+    inputs = builtin.inputs
+    address_bits = inputs.get('address', 0)
+    pools = [[generator.getrandbits(address_bits) for _ in range(4)]
+             for _ in range(count)]
+
+    trace = []
+    for _ in range(steps):
+        step = {}
+        for pin, width in inputs.items():
+            if pin == 'address':
+                step[pin] = [generator.choice(pool) if generator.random() < .5
+                             else generator.getrandbits(width)
+                             for pool in pools]
+            else:
+                step[pin] = [generator.getrandbits(width)
+                             for _ in range(count)]
+        trace.append(step)
+    return trace
+
+
+def differential_test(name: str, count: int = 64, steps: int = 200,
+                      seed: int = 0, gates: bool = False) -> list:
+    # Runs random read/write traces through the builtin chip and through
+    # its .hdl implementation, which uses the other builtins for its
+    # parts (or is gate-level if gates is set, down to the builtins
+    # without an .hdl file, Screen and Keyboard). Returns the
+    # mismatches as (step, vector, expected, actual).
+    import hdl
+    import netlist
+
+    builtin = BUILTINS[name]
+    chip = hdl.load_chip(name)
+    others = [other for other in BUILTINS if other != name
+              and not (gates and hdl.load_chip(other).path is not None)]
+    reference = netlist.NetlistSimulator(
+        netlist.compile_chip(chip, builtins=others), count)
+    fast = hdl.Simulator(chip, count)
+
+    mismatches = []
+    for step, inputs in enumerate(random_trace(builtin, count, steps, seed)):
+        expected = {}
+        for simulator in (reference, fast):
+            planes = {pin: hdl.pack(words, width)
+                      for (pin, words), width in zip(inputs.items(),
+                                                     builtin.inputs.values())}
+            outputs = {pin: hdl.unpack(planes, count)
+                       for pin, planes in simulator.tick(planes).items()}
+            if simulator is reference:
+                expected = outputs
+        for pin, words in outputs.items():
+            for vector, (wanted, actual) in enumerate(zip(expected[pin],
+                                                          words)):
+                if wanted != actual:
+                    mismatches.append((step, vector, wanted, actual))
+    return mismatches
+
+
+def main():
+    import argparse
+
+    argument_parser = argparse.ArgumentParser(
+        description='Checks builtin chips against their .hdl '
+                    'implementation on random read/write traces.')
+    argument_parser.add_argument('chips', nargs='*',
+                                 help='builtin chips to check (default: '
+                                      'all with an .hdl file)')
+    argument_parser.add_argument('--traces', type=int, default=64,
+                                 help='traces run in parallel')
+    argument_parser.add_argument('--steps', type=int, default=200,
+                                 help='clock cycles per trace')
+    argument_parser.add_argument('--seed', type=int, default=0)
+    argument_parser.add_argument(
+        '--gates', action='store_true',
+        help='compare with the fully gate-level chip instead of the chip '
+             'built from other builtins')
+    arguments = argument_parser.parse_args()
+
+    import hdl
+    names = arguments.chips or [name for name in BUILTINS
+                                if hdl.load_chip(name).path is not None]
+    failed = False
+    for name in names:
+        mismatches = differential_test(name, arguments.traces,
+                                       arguments.steps, arguments.seed,
+                                       arguments.gates)
+        for step, vector, expected, actual in mismatches[:5]:
+            print(f'{name}: step {step}, trace {vector}: expected '
+                  f'{expected}, got {actual}')
+        print(f'{name}: {"FAIL" if mismatches else "ok"}')
+        failed = failed or bool(mismatches)
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,535 @@
+# hdl.py
+# Loads nand2tetris .hdl chips and simulates them on many input vectors
+# at once.
+#
+# Simulation is bit-sliced: every bit of every pin holds a Python int
+# used as a bit vector, where bit k is the value of that pin in test
+# vector k. A Nand gate is then a single bitwise operation for all
+# vectors; a 16-bit bus is a list of 16 such ints (bit planes).
+# pack() and unpack() convert between bit planes and lists of words.
+#
+# Chips are loaded from the project directories next to this one.
+# Nand and DFF are the primitive chips; sequential chips are clocked
+# with Simulator.tick(). Memory chips are replaced by the word-level
+# builtins of builtin_chips.py unless builtins=() is given.
+import re
+import sys
+from array import array
+from contextlib import contextmanager
+from pathlib import Path
+
+from builtin_chips import BUILTINS
+
+HDL_PATH = sorted(Path(__file__).resolve().parent.parent.glob('project0*'))
+
+# builtin chips of the book whose interface matches a chip of ours
+BUILTIN_ALIASES = {'ARegister': 'Register', 'DRegister': 'Register'}
+
+PIN_PATTERN = re.compile(r'(\w+)\s*(?:\[\s*(\d+)\s*\])?')
+PART_PATTERN = re.compile(r'(\w+)\s*\(([^)]*)\)\s*;')
+CONNECTION_PATTERN = re.compile(
+    r'(\w+)\s*(?:\[\s*(\d+)\s*(?:\.\.\s*(\d+)\s*)?\])?')
+
+
+class Chip:
+    # A chip definition. sources maps every (signal, bit) inside the
+    # chip to what drives it: ('in', pin, bit) for the chip's inputs or
+    # ('part', index, pin, bit) for an output of a part.
+    # part_inputs[index] maps (pin, bit) of a part's input to the
+    # (signal, bit) feeding it, or to True/False for constants.
+
+    def __init__(self, name: str, inputs: dict, outputs: dict) -> None:
+        self.name = name
+        self.inputs = inputs  # pin name -> width
+        self.outputs = outputs
+        self.path = None  # .hdl file, None for builtin chips
+        self.parts = []  # part Chips
+        self.part_inputs = []
+        self.sources = {(pin, bit): ('in', pin, bit)
+                        for pin, width in inputs.items()
+                        for bit in range(width)}
+
+    def add_part(self, chip: 'Chip', connections: list) -> None:
+        index = len(self.parts)
+        self.parts.append(chip)
+        inputs = {}
+
+        for pin, pin_range, signal, signal_range in connections:
+            if pin in chip.inputs:
+                width = chip.inputs[pin]
+            elif pin in chip.outputs:
+                width = chip.outputs[pin]
+            else:
+                raise ValueError(f'{chip.name} has no pin {pin} '
+                                 f'(in {self.name})')
+            low, high = pin_range if pin_range else (0, width - 1)
+            if signal_range:
+                signal_low = signal_range[0]
+            else:
+                signal_low = 0
+            bits = range(high - low + 1)
+
+            if pin in chip.inputs:
+                for bit in bits:
+                    if signal in ('true', 'false'):
+                        inputs[(pin, low + bit)] = signal == 'true'
+                    else:
+                        inputs[(pin, low + bit)] = (signal,
+                                                    signal_low + bit)
+            else:
+                for bit in bits:
+                    self.sources[(signal, signal_low + bit)] = \
+                        ('part', index, pin, low + bit)
+
+        self.part_inputs.append(inputs)
+
+    def check(self) -> None:
+        # every signal read must be driven by something
+        for index, inputs in enumerate(self.part_inputs):
+            for pin, source in inputs.items():
+                if source not in (True, False) and source not in self.sources:
+                    raise ValueError(
+                        f'{self.name}: {self.parts[index].name}.{pin[0]} '
+                        f'reads {source[0]}[{source[1]}], which is not '
+                        f'driven')
+        for pin, width in self.outputs.items():
+            for bit in range(width):
+                if (pin, bit) not in self.sources:
+                    raise ValueError(f'{self.name}: output {pin}[{bit}] '
+                                     f'is not driven')
+
+
+NAND = Chip('Nand', {'a': 1, 'b': 1}, {'out': 1})
+DFF = Chip('DFF', {'in': 1}, {'out': 1})
+
+_chips = {'Nand': NAND, 'DFF': DFF}
+
+
+def parse_pins(text: str) -> dict:
+    return {name: int(width) if width else 1
+            for name, width in PIN_PATTERN.findall(text)}
+
+
+def parse_connection(text: str) -> tuple:
+    # 'out[0..7]=low' -> ('out', (0, 7), 'low', None)
+    left, right = text.split('=')
+    ranges = []
+    names = []
+    for side in (left, right):
+        match = CONNECTION_PATTERN.fullmatch(side.strip())
+        if match is None:
+            raise ValueError(f'Invalid connection {text.strip()}')
+        name, low, high = match.groups()
+        names.append(name)
+        if low is None:
+            ranges.append(None)
+        else:
+            ranges.append((int(low), int(high if high else low)))
+    return names[0], ranges[0], names[1], ranges[1]
+
+
+def find_hdl(name: str, directories=None) -> Path:
+    for directory in directories or HDL_PATH:
+        path = Path(directory) / f'{name}.hdl'
+        if path.exists():
+            return path
+    raise ValueError(f'{name}.hdl not found')
+
+
+def load_chip(name: str, directories=None) -> Chip:
+    # Loads a chip and all the chips it uses. Definitions are cached.
+    name = BUILTIN_ALIASES.get(name, name)
+    if name in _chips:
+        return _chips[name]
+
+    try:
+        path = find_hdl(name, directories)
+    except ValueError:
+        if name not in BUILTINS:
+            raise
+        # builtin only, e.g. Screen: pins but no parts
+        builtin = BUILTINS[name]
+        chip = Chip(name, dict(builtin.inputs), dict(builtin.outputs))
+        _chips[name] = chip
+        return chip
+
+    text = re.sub(r'//[^\n]*|/\*.*?\*/', '', path.read_text(), flags=re.S)
+    match = re.search(r'CHIP\s+(\w+)\s*\{\s*IN\b(.*?);\s*(?:OUT\b(.*?);)?'
+                      r'\s*PARTS\s*:(.*)\}', text, flags=re.S)
+    if match is None:
+        raise ValueError(f'{path}: expected CHIP {name} {{ IN ...; '
+                         f'OUT ...; PARTS: ... }}')
+    _, inputs, outputs, parts = match.groups()
+
+    chip = Chip(name, parse_pins(inputs), parse_pins(outputs or ''))
+    chip.path = path
+    for part_name, connections in PART_PATTERN.findall(parts):
+        chip.add_part(load_chip(part_name, directories),
+                      [parse_connection(connection)
+                       for connection in connections.split(',')])
+    chip.check()
+
+    _chips[name] = chip
+    return chip
+
+
+class Instance:
+    # One occurrence of a chip in the hierarchy. parent and index locate
+    # the part in its parent; DFFs hold their state as a bit vector.
+    # Chips named in builtins get no parts; the simulator attaches the
+    # builtin object.
+
+    def __init__(self, chip: Chip, parent=None, index: int = 0,
+                 builtins=()) -> None:
+        self.chip = chip
+        self.parent = parent
+        self.index = index
+        self.state = 0
+        self.builtin = None
+        if chip.name in builtins:
+            self.parts = []
+            return
+        if chip.path is None and chip not in (NAND, DFF):
+            raise ValueError(f'{chip.name} is only available as a builtin')
+        self.parts = [Instance(part, self, i, builtins)
+                      for i, part in enumerate(chip.parts)]
+
+    def dffs(self):
+        if self.chip is DFF:
+            yield self
+        for part in self.parts:
+            yield from part.dffs()
+
+    def builtins(self, names):
+        if self.chip.name in names:
+            yield self
+        for part in self.parts:
+            yield from part.builtins(names)
+
+
+@contextmanager
+def deep_recursion():
+    # signals are traced recursively, through every level of the chip
+    # hierarchy and along carry chains
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 100_000))
+    try:
+        yield
+    finally:
+        sys.setrecursionlimit(limit)
+
+
+class Simulator:
+    # Evaluates a chip on count vectors at once by walking its hierarchy
+    # on demand: each requested output bit is traced back through the
+    # parts to the chip inputs and DFF states, memoizing every signal.
+    # builtins names the chips simulated by their word-level builtin
+    # (default: all of BUILTINS).
+
+    def __init__(self, chip: Chip, count: int, builtins=None) -> None:
+        if builtins is None:
+            builtins = BUILTINS
+        self.chip = chip
+        self.count = count
+        self.mask = (1 << count) - 1
+        self.root = Instance(chip, builtins=builtins)
+        self.dffs = list(self.root.dffs())
+        self.builtin_instances = list(self.root.builtins(builtins))
+        for instance in self.builtin_instances:
+            instance.builtin = BUILTINS[instance.chip.name](count)
+        self.inputs = {}
+        self.values = {}
+
+    def builtin(self, name: str):
+        # the first builtin object simulating chip name, e.g. to load
+        # ROM32K or inspect Memory
+        for instance in self.builtin_instances:
+            if instance.chip.name == name:
+                return instance.builtin
+        raise KeyError(name)
+
+    def evaluate(self, inputs: dict) -> dict:
+        # inputs maps each input pin to its bit planes (missing pins are
+        # false); returns the bit planes of every output pin
+        self.inputs = inputs
+        self.values = {}
+        with deep_recursion():
+            return {pin: [self.output(self.root, pin, bit)
+                          for bit in range(width)]
+                    for pin, width in self.chip.outputs.items()}
+
+    def tick(self, inputs: dict) -> dict:
+        # Evaluates the outputs, then clocks every DFF and builtin.
+        # Returns the outputs from before the clock edge.
+        outputs = self.evaluate(inputs)
+        states = self.next_states()
+        with deep_recursion():
+            clocked = [(instance.builtin, self.builtin_inputs(
+                instance, instance.builtin.inputs))
+                for instance in self.builtin_instances]
+        for dff, state in zip(self.dffs, states):
+            dff.state = state
+        for builtin, builtin_inputs in clocked:
+            builtin.clock(builtin_inputs)
+        return outputs
+
+    def next_states(self) -> list:
+        # the value each DFF loads on the next clock edge, for the
+        # inputs of the last evaluate()
+        with deep_recursion():
+            return [self.input(dff, 'in', 0) for dff in self.dffs]
+
+    def output(self, instance: Instance, pin: str, bit: int) -> int:
+        chip = instance.chip
+        if chip is NAND:
+            return self.mask ^ (self.input(instance, 'a', 0)
+                                & self.input(instance, 'b', 0))
+        if chip is DFF:
+            return instance.state
+        if instance.builtin is not None:
+            return self.builtin_outputs(instance)[pin][bit]
+        return self.signal(instance, (pin, bit))
+
+    def builtin_inputs(self, instance: Instance, pins) -> dict:
+        # the words on the given input pins of a builtin
+        return {pin: unpack([self.input(instance, pin, bit)
+                             for bit in range(instance.chip.inputs[pin])],
+                            self.count)
+                for pin in pins}
+
+    def builtin_outputs(self, instance: Instance) -> dict:
+        key = (instance, None)
+        try:
+            return self.values[key]
+        except KeyError:
+            pass
+        builtin = instance.builtin
+        words = builtin.evaluate(
+            self.builtin_inputs(instance, builtin.combinational))
+        planes = {pin: pack(words[pin], width)
+                  for pin, width in builtin.outputs.items()}
+        self.values[key] = planes
+        return planes
+
+    def input(self, instance: Instance, pin: str, bit: int) -> int:
+        parent = instance.parent
+        if parent is None:
+            planes = self.inputs.get(pin)
+            return planes[bit] if planes else 0
+
+        source = parent.chip.part_inputs[instance.index].get((pin, bit))
+        if source is None or source is False:
+            return 0
+        if source is True:
+            return self.mask
+        return self.signal(parent, source)
+
+    def signal(self, instance: Instance, key: tuple) -> int:
+        try:
+            return self.values[instance, key]
+        except KeyError:
+            pass
+
+        source = instance.chip.sources[key]
+        if source[0] == 'in':
+            value = self.input(instance, source[1], source[2])
+        else:
+            value = self.output(instance.parts[source[1]], source[2],
+                                source[3])
+        self.values[instance, key] = value
+        return value
+
+
+# Conversion between lists of words (up to 16 bits) and bit planes.
+# Both directions go through bytes so no Python loop runs per vector.
+
+_BIT_TABLES = [bytes(48 + (byte >> bit & 1) for byte in range(256))
+               for bit in range(8)]
+_DIGITS = bytes.maketrans(b'01', b'\x00\x01')
+
+
+def pack(values, width: int = 16) -> list:
+    # Returns the bit planes of a list of unsigned words
+    words = array('H', values)
+    if sys.byteorder == 'big':
+        words.byteswap()
+    data = words.tobytes()
+    halves = [data[0::2], data[1::2]]
+
+    planes = []
+    for bit in range(width):
+        digits = halves[bit >> 3].translate(_BIT_TABLES[bit & 7])
+        planes.append(int(digits[::-1], 2) if digits else 0)
+    return planes
+
+
+def unpack(planes: list, count: int) -> list:
+    # Returns the count words held in a list of (up to 16) bit planes
+    halves = [0, 0]
+    for bit, plane in enumerate(planes):
+        digits = format(plane, f'0{count}b').encode()[::-1][:count]
+        halves[bit >> 3] += int.from_bytes(digits.translate(_DIGITS),
+                                           'little') << (bit & 7)
+
+    data = bytearray(2 * count)
+    data[0::2] = halves[0].to_bytes(count, 'little')
+    data[1::2] = halves[1].to_bytes(count, 'little')
+    words = array('H')
+    words.frombytes(data)
+    if sys.byteorder == 'big':
+        words.byteswap()
+    return words.tolist()
+
+
+def exhaustive_inputs(chip: Chip) -> tuple:
+    # Returns (inputs, count) enumerating every input combination; the
+    # bits of all inputs together count up from 0 to count - 1
+    count = 1 << sum(chip.inputs.values())
+    mask = (1 << count) - 1
+    inputs = {}
+    position = 0
+    for pin, width in chip.inputs.items():
+        planes = []
+        for _ in range(width):
+            # period of 2 ** (position + 1) vectors: half 0s, half 1s
+            half = 1 << position
+            unit = ((1 << half) - 1) << half
+            planes.append(unit * (mask // ((1 << 2 * half) - 1)))
+            position += 1
+        inputs[pin] = planes
+    return inputs, count
+
+
+def random_inputs(chip: Chip, count: int, seed: int = 0) -> dict:
+    import random
+    generator = random.Random(seed)
+    return {pin: [generator.getrandbits(count) for _ in range(width)]
+            for pin, width in chip.inputs.items()}
+
+
+# Reference models of the combinational chips, one vector at a time,
+# on unsigned words
+def _alu(x, y, zx, nx, zy, ny, f, no):
+    if zx:
+        x = 0
+    if nx:
+        x ^= 0xFFFF
+    if zy:
+        y = 0
+    if ny:
+        y ^= 0xFFFF
+    out = (x + y if f else x & y) & 0xFFFF
+    if no:
+        out ^= 0xFFFF
+    return {'out': out, 'zr': int(out == 0), 'ng': out >> 15}
+
+
+def _dmux(count):
+    names = 'abcdefgh'[:count]
+    return lambda i, sel: {name: i if sel == k else 0
+                           for k, name in enumerate(names)}
+
+
+MODELS = {
+    'Not': lambda i: {'out': i ^ 1},
+    'And': lambda a, b: {'out': a & b},
+    'Or': lambda a, b: {'out': a | b},
+    'Xor': lambda a, b: {'out': a ^ b},
+    'Mux': lambda a, b, sel: {'out': b if sel else a},
+    'DMux': _dmux(2),
+    'DMux4Way': _dmux(4),
+    'DMux8Way': _dmux(8),
+    'Not16': lambda i: {'out': i ^ 0xFFFF},
+    'And16': lambda a, b: {'out': a & b},
+    'Or16': lambda a, b: {'out': a | b},
+    'Mux16': lambda a, b, sel: {'out': b if sel else a},
+    'Or8Way': lambda i: {'out': int(i != 0)},
+    'Mux4Way16': lambda a, b, c, d, sel: {'out': (a, b, c, d)[sel]},
+    'Mux8Way16': lambda a, b, c, d, e, f, g, h, sel:
+        {'out': (a, b, c, d, e, f, g, h)[sel]},
+    'HalfAdder': lambda a, b: {'sum': a ^ b, 'carry': a & b},
+    'FullAdder': lambda a, b, c: {'sum': (a + b + c) & 1,
+                                  'carry': (a + b + c) >> 1},
+    'Add16': lambda a, b: {'out': (a + b) & 0xFFFF},
+    'Inc16': lambda i: {'out': (i + 1) & 0xFFFF},
+    'ALU': _alu,
+}
+
+
+def verify(chip: Chip, inputs: dict, outputs: dict, count: int) -> list:
+    # Checks simulated outputs against the chip's reference model.
+    # Returns the failing vectors as (inputs, expected, actual) dicts.
+    model = MODELS[chip.name]
+    # 'in' is a keyword, models take it as 'i'
+    names = ['i' if pin == 'in' else pin for pin in chip.inputs]
+    columns = [unpack(inputs.get(pin, []), count) for pin in chip.inputs]
+    results = {pin: unpack(planes, count) for pin, planes in outputs.items()}
+
+    failures = []
+    for vector, values in enumerate(zip(*columns)):
+        expected = model(*values)
+        for pin, value in expected.items():
+            if results[pin][vector] != value:
+                actual = {pin: results[pin][vector] for pin in results}
+                failures.append((dict(zip(chip.inputs, values)),
+                                 expected, actual))
+                break
+    return failures
+
+
+def main():
+    import argparse
+    import time
+
+    argument_parser = argparse.ArgumentParser(
+        description='Simulates an HDL chip on many input vectors at once '
+                    'and checks combinational chips against a reference '
+                    'model.')
+    argument_parser.add_argument('chip', help='chip name or .hdl file')
+    argument_parser.add_argument(
+        '--vectors', type=int, default=1_000_000,
+        help='number of random input vectors, for chips with too many '
+             'inputs to test exhaustively (default 1000000)')
+    argument_parser.add_argument('--seed', type=int, default=0)
+    argument_parser.add_argument(
+        '--exhaustive-bits', type=int, default=24,
+        help='test every input combination of chips with up to this many '
+             'input bits (default 24)')
+    arguments = argument_parser.parse_args()
+
+    directories = None
+    name = arguments.chip
+    if name.endswith('.hdl'):
+        path = Path(name)
+        name = path.stem
+        directories = [path.resolve().parent] + HDL_PATH
+    chip = load_chip(name, directories)
+
+    if sum(chip.inputs.values()) <= arguments.exhaustive_bits:
+        inputs, count = exhaustive_inputs(chip)
+        kind = 'exhaustive'
+    else:
+        count = arguments.vectors
+        inputs = random_inputs(chip, count, arguments.seed)
+        kind = 'random'
+
+    simulator = Simulator(chip, count)
+    start = time.perf_counter()
+    outputs = simulator.evaluate(inputs)
+    elapsed = time.perf_counter() - start
+    print(f'{chip.name}: {count:,} {kind} vectors in {elapsed:.3f}s '
+          f'({count / elapsed:,.0f} vectors/s)')
+
+    if chip.name in MODELS:
+        failures = verify(chip, inputs, outputs, count)
+        for vector_inputs, expected, actual in failures[:10]:
+            print(f'FAIL {vector_inputs}: expected {expected}, '
+                  f'got {actual}')
+        print(f'{len(failures):,} of {count:,} vectors failed')
+        sys.exit(1 if failures else 0)
+    else:
+        print(f'no reference model for {chip.name}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,438 @@
+# netlist.py
+# Compiles an HDL chip into a flat netlist of Nand gates and DFFs.
+#
+# The chip hierarchy is walked once (with the same on-demand tracing as
+# hdl.Simulator, but on node numbers instead of values). Gates are
+# hash-consed, so identical Nands are shared, and constant inputs and
+# double negations are folded as the gates are created; gates that end
+# up unused are removed. The result is an integer-indexed program that
+# is evaluated without touching the hierarchy again.
+#
+# Builtin chips (builtin_chips.py) stay black boxes: each bit of their
+# outputs is one entry of the program, computed by calling the builtin
+# from the words on its combinational inputs.
+#
+# Netlists are cached on disk, keyed by a hash of the .hdl sources of
+# every chip used, the builtins and the compiler itself.
+import hashlib
+import json
+import os
+import sys
+from array import array
+from pathlib import Path
+
+import hdl
+from builtin_chips import BUILTINS
+
+FALSE = 0
+TRUE = 1
+
+
+class Netlist:
+    # Node 0 is false and node 1 is true, followed by one node per input
+    # bit, one per DFF (its state) and one per gate, in evaluation
+    # order. gates holds the two operand nodes of every gate,
+    # next_states the node each DFF loads on a clock edge and outputs
+    # the node of every output bit.
+    # builtins lists (chip name, {input pin: nodes}) for every builtin;
+    # a gate entry (-1 - k, bit) stands for output bit number bit of
+    # builtin k, counting across its output pins.
+
+    def __init__(self, name: str, inputs: dict, outputs: dict,
+                 num_dffs: int, gates: array, next_states: array,
+                 builtins: list = ()) -> None:
+        self.name = name
+        self.inputs = inputs  # pin name -> width
+        self.outputs = outputs  # pin name -> list of nodes
+        self.num_dffs = num_dffs
+        self.gates = gates
+        self.next_states = next_states
+        self.builtins = list(builtins)
+
+    @property
+    def num_entries(self) -> int:
+        return len(self.gates) // 2
+
+    @property
+    def num_gates(self) -> int:
+        return sum(1 for a in self.gates[0::2] if a >= 0)
+
+    @property
+    def first_state(self) -> int:
+        return 2 + sum(self.inputs.values())
+
+    @property
+    def first_gate(self) -> int:
+        return self.first_state + self.num_dffs
+
+    def to_bytes(self) -> bytes:
+        header = json.dumps({
+            'name': self.name, 'inputs': self.inputs,
+            'outputs': self.outputs, 'num_dffs': self.num_dffs,
+            'num_entries': self.num_entries, 'builtins': self.builtins,
+        }).encode()
+        return header + b'\n' + self.gates.tobytes() \
+            + self.next_states.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'Netlist':
+        header, data = data.split(b'\n', 1)
+        header = json.loads(header)
+        gates = array('i')
+        gates.frombytes(data[:2 * header['num_entries'] * gates.itemsize])
+        next_states = array('i')
+        next_states.frombytes(data[len(gates) * gates.itemsize:])
+        return cls(header['name'], header['inputs'], header['outputs'],
+                   header['num_dffs'], gates, next_states,
+                   [tuple(builtin) for builtin in header['builtins']])
+
+
+class Flattener(hdl.Simulator):
+    # Runs the hierarchical simulator on node numbers: NAND creates (or
+    # reuses) a gate node, constants are the TRUE and FALSE nodes.
+
+    def __init__(self, chip: hdl.Chip, builtins=None) -> None:
+        super().__init__(chip, 1, builtins)
+        self.mask = TRUE  # what Simulator.input() returns for 'true'
+        self.first_state = 2 + sum(chip.inputs.values())
+        for node, dff in enumerate(self.dffs, self.first_state):
+            dff.state = node
+        self.first_gate = self.first_state + len(self.dffs)
+        self.gates = array('i')
+        self.table = {}  # (a, b) -> gate node
+        self.negations = {}  # node -> node of its negation
+        self.builtin_numbers = {instance: number for number, instance
+                                in enumerate(self.builtin_instances)}
+
+    def output(self, instance: hdl.Instance, pin: str, bit: int) -> int:
+        if instance.chip is hdl.NAND:
+            return self.nand(self.input(instance, 'a', 0),
+                             self.input(instance, 'b', 0))
+        return super().output(instance, pin, bit)
+
+    def builtin_outputs(self, instance: hdl.Instance) -> dict:
+        # one entry per output bit, after the nodes of the inputs
+        key = (instance, None)
+        try:
+            return self.values[key]
+        except KeyError:
+            pass
+        builtin = instance.builtin
+        for pin in builtin.combinational:
+            for bit in range(instance.chip.inputs[pin]):
+                self.input(instance, pin, bit)
+
+        number = -1 - self.builtin_numbers[instance]
+        nodes = {}
+        position = 0
+        for pin, width in builtin.outputs.items():
+            nodes[pin] = []
+            for _ in range(width):
+                nodes[pin].append(self.first_gate + len(self.gates) // 2)
+                self.gates.append(number)
+                self.gates.append(position)
+                position += 1
+        self.values[key] = nodes
+        return nodes
+
+    def nand(self, a: int, b: int) -> int:
+        if a > b:
+            a, b = b, a
+        if a == FALSE:
+            return TRUE
+        if a == TRUE:
+            return FALSE if b == TRUE else self.negate(b)
+        if a == b:
+            return self.negate(a)
+        if self.negations.get(a) == b:
+            return TRUE  # x nand not x
+        return self.gate(a, b)
+
+    def negate(self, node: int) -> int:
+        if node in self.negations:
+            return self.negations[node]
+        gate = self.gate(node, node)
+        self.negations[node] = gate
+        self.negations[gate] = node
+        return gate
+
+    def gate(self, a: int, b: int) -> int:
+        try:
+            return self.table[a, b]
+        except KeyError:
+            pass
+        node = self.first_gate + len(self.gates) // 2
+        self.gates.append(a)
+        self.gates.append(b)
+        self.table[a, b] = node
+        return node
+
+    def netlist(self) -> Netlist:
+        first_input = 2
+        inputs = {}
+        for pin, width in self.chip.inputs.items():
+            inputs[pin] = list(range(first_input, first_input + width))
+            first_input += width
+        outputs = self.evaluate(inputs)
+        next_states = self.next_states()
+        builtins = []
+        with hdl.deep_recursion():
+            for instance in self.builtin_instances:
+                builtins.append((instance.chip.name, {
+                    pin: [self.input(instance, pin, bit)
+                          for bit in range(width)]
+                    for pin, width in instance.chip.inputs.items()}))
+        return remove_unused(Netlist(
+            self.chip.name, dict(self.chip.inputs), outputs,
+            len(self.dffs), self.gates, array('i', next_states), builtins))
+
+
+def remove_unused(netlist: Netlist) -> Netlist:
+    # Drops gates that no output or DFF depends on, renumbering the rest
+    first_gate = netlist.first_gate
+    gates = netlist.gates
+    used = bytearray(first_gate + netlist.num_entries)
+    for nodes in netlist.outputs.values():
+        for node in nodes:
+            used[node] = 1
+    for node in netlist.next_states:
+        used[node] = 1
+    for _, pins in netlist.builtins:
+        for nodes in pins.values():
+            for node in nodes:
+                used[node] = 1
+    for node in range(len(used) - 1, first_gate - 1, -1):
+        index = 2 * (node - first_gate)
+        if used[node] and gates[index] >= 0:
+            used[gates[index]] = 1
+            used[gates[index + 1]] = 1
+
+    renumbered = list(range(first_gate)) + [0] * netlist.num_entries
+    kept = array('i')
+    for node in range(first_gate, len(used)):
+        if used[node]:
+            index = 2 * (node - first_gate)
+            renumbered[node] = first_gate + len(kept) // 2
+            if gates[index] < 0:  # builtin output
+                kept.append(gates[index])
+                kept.append(gates[index + 1])
+            else:
+                kept.append(renumbered[gates[index]])
+                kept.append(renumbered[gates[index + 1]])
+
+    return Netlist(
+        netlist.name, netlist.inputs,
+        {pin: [renumbered[node] for node in nodes]
+         for pin, nodes in netlist.outputs.items()},
+        netlist.num_dffs, kept,
+        array('i', [renumbered[node] for node in netlist.next_states]),
+        [(name, {pin: [renumbered[node] for node in nodes]
+                 for pin, nodes in pins.items()})
+         for name, pins in netlist.builtins])
+
+
+def flatten(chip: hdl.Chip, builtins=None) -> Netlist:
+    return Flattener(chip, builtins).netlist()
+
+
+def chip_sources(chip: hdl.Chip) -> list:
+    # every chip the hierarchy uses, once, sorted by name
+    chips = {}
+    pending = [chip]
+    while pending:
+        chip = pending.pop()
+        if chip.name not in chips:
+            chips[chip.name] = chip
+            pending.extend(chip.parts)
+    return [chips[name] for name in sorted(chips)]
+
+
+def cache_key(chip: hdl.Chip, builtins) -> str:
+    digest = hashlib.sha256()
+    for source in ['hdl.py', 'netlist.py', 'builtin_chips.py']:
+        digest.update((Path(__file__).parent / source).read_bytes())
+    digest.update(' '.join(sorted(builtins)).encode())
+    for used in chip_sources(chip):
+        digest.update(f'{used.name}:'.encode())
+        if used.path is not None:
+            digest.update(used.path.read_bytes())
+    return digest.hexdigest()
+
+
+def compile_chip(chip: hdl.Chip, cache_dir=None, builtins=None) -> Netlist:
+    # Flattens chip, reusing a cached netlist when its sources have not
+    # changed. cache_dir=False disables the cache.
+    if builtins is None:
+        builtins = BUILTINS
+    if cache_dir is False:
+        return flatten(chip, builtins)
+    if cache_dir is None:
+        cache_dir = Path(__file__).resolve().parent / '.hdl_cache'
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    entry = cache_dir / cache_key(chip, builtins)
+    try:
+        return Netlist.from_bytes(entry.read_bytes())
+    except FileNotFoundError:
+        pass
+
+    netlist = flatten(chip, builtins)
+    temp = entry.with_suffix('.tmp')
+    temp.write_bytes(netlist.to_bytes())
+    os.replace(temp, entry)  # readers never see a partial entry
+    return netlist
+
+
+class NetlistSimulator:
+    # Evaluates a netlist on count vectors at once, with the same
+    # interface as hdl.Simulator
+
+    def __init__(self, netlist: Netlist, count: int) -> None:
+        self.netlist = netlist
+        self.count = count
+        self.mask = (1 << count) - 1
+        self.states = [0] * netlist.num_dffs
+        self.values = []
+        self.builtins = [BUILTINS[name](count)
+                         for name, _ in netlist.builtins]
+
+        # runs of gates between builtin outputs: (start, stop, index of
+        # the builtin entry after them or None)
+        gates = netlist.gates
+        self.segments = []
+        start = 0
+        for index in range(0, len(gates), 2):
+            if gates[index] < 0:
+                self.segments.append((start, index, index))
+                start = index + 2
+        self.segments.append((start, len(gates), None))
+
+    def builtin(self, name: str):
+        # the first builtin object simulating chip name
+        for (builtin_name, _), builtin in zip(self.netlist.builtins,
+                                              self.builtins):
+            if builtin_name == name:
+                return builtin
+        raise KeyError(name)
+
+    def evaluate(self, inputs: dict) -> dict:
+        netlist = self.netlist
+        mask = self.mask
+        values = [0, mask]
+        for pin, width in netlist.inputs.items():
+            planes = inputs.get(pin)
+            values.extend(planes if planes else [0] * width)
+        values.extend(self.states)
+
+        gates = netlist.gates
+        append = values.append
+        builtin_outputs = {}
+        for start, stop, builtin_entry in self.segments:
+            for index in range(start, stop, 2):
+                append(mask ^ (values[gates[index]]
+                               & values[gates[index + 1]]))
+            if builtin_entry is not None:
+                number = -1 - gates[builtin_entry]
+                if number not in builtin_outputs:
+                    builtin_outputs[number] = self.builtin_outputs(
+                        number, values)
+                append(builtin_outputs[number][gates[builtin_entry + 1]])
+
+        self.values = values
+        return {pin: [values[node] for node in nodes]
+                for pin, nodes in netlist.outputs.items()}
+
+    def builtin_inputs(self, number: int, values: list, pins) -> dict:
+        nodes = self.netlist.builtins[number][1]
+        return {pin: hdl.unpack([values[node] for node in nodes[pin]],
+                                self.count)
+                for pin in pins}
+
+    def builtin_outputs(self, number: int, values: list) -> list:
+        # the bit planes of all outputs of builtin number, in order
+        builtin = self.builtins[number]
+        words = builtin.evaluate(self.builtin_inputs(
+            number, values, builtin.combinational))
+        return [plane for pin, width in builtin.outputs.items()
+                for plane in hdl.pack(words[pin], width)]
+
+    def tick(self, inputs: dict) -> dict:
+        outputs = self.evaluate(inputs)
+        self.states = self.next_states()
+        for number, builtin in enumerate(self.builtins):
+            builtin.clock(self.builtin_inputs(number, self.values,
+                                              builtin.inputs))
+        return outputs
+
+    def next_states(self) -> list:
+        values = self.values
+        return [values[node] for node in self.netlist.next_states]
+
+
+def count_primitives(chip: hdl.Chip, counts=None) -> tuple:
+    # (Nand gates, DFFs) in the chip hierarchy before flattening
+    if counts is None:
+        counts = {}
+    if chip is hdl.NAND:
+        return 1, 0
+    if chip is hdl.DFF:
+        return 0, 1
+    if chip.name not in counts:
+        nands = dffs = 0
+        for part in chip.parts:
+            part_nands, part_dffs = count_primitives(part, counts)
+            nands += part_nands
+            dffs += part_dffs
+        counts[chip.name] = nands, dffs
+    return counts[chip.name]
+
+
+def main():
+    import argparse
+    import time
+
+    argument_parser = argparse.ArgumentParser(
+        description='Flattens an HDL chip into Nand gates and DFFs and '
+                    'compares hierarchical with flat simulation.')
+    argument_parser.add_argument('chip', help='chip name')
+    argument_parser.add_argument('--vectors', type=int, default=100_000,
+                                 help='number of random input vectors')
+    argument_parser.add_argument('--no-cache', action='store_true',
+                                 help='always flatten, ignoring the cache')
+    argument_parser.add_argument('--gates', action='store_true',
+                                 help='simulate memory chips gate by gate '
+                                      'instead of using builtins')
+    arguments = argument_parser.parse_args()
+
+    chip = hdl.load_chip(arguments.chip)
+    nands, dffs = count_primitives(chip)
+    builtins = () if arguments.gates else None
+
+    start = time.perf_counter()
+    netlist = compile_chip(chip, False if arguments.no_cache else None,
+                           builtins)
+    elapsed = time.perf_counter() - start
+    print(f'{chip.name}: {nands:,} Nand gates, {dffs:,} DFFs in the '
+          f'hierarchy; {netlist.num_gates:,} Nand gates after flattening '
+          f'({elapsed:.3f}s)')
+
+    count = arguments.vectors
+    inputs = hdl.random_inputs(chip, count)
+    results = []
+    for label, simulator in [
+            ('hierarchical', hdl.Simulator(chip, count, builtins)),
+            ('flat', NetlistSimulator(netlist, count))]:
+        start = time.perf_counter()
+        results.append(simulator.tick(inputs))
+        results.append(simulator.evaluate(inputs))
+        elapsed = time.perf_counter() - start
+        print(f'{label}: {2 * count / elapsed:,.0f} vectors/s')
+
+    if results[:2] != results[2:]:
+        print('hierarchical and flat simulation disagree')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,167 @@
-def main():
-    import sys
-    from parsr import Parser, A_COMMAND, C_COMMAND, L_COMMAND
+# assembler.py
+# Hack assembler. Can be imported: assemble() works entirely in
+# memory, prints nothing and imports its modules on first use.
+from typing import Iterable, List, Union
+
+
+def assemble(source: Union[str, Iterable[str]], symbol_table=None,
+             line_numbers=None) -> List[int]:
+    # Assembles Hack assembly source, given as one string or as lines,
+    # into a list of 16-bit instructions. Labels and variables are
+    # added to symbol_table if one is given, the source line number of
+    # every instruction to line_numbers (an array('i')).
+    from streaming import assemble_lines
+
+    if isinstance(source, str):
+        source = source.splitlines()
+
+    return list(assemble_lines(source, symbol_table, line_numbers))
+
+
+def assemble_file(path: str, output_format: str = 'hack',
+                  source_map: bool = False) -> str:
+    # Assembles the .asm file at path, returns the output file path.
+    # With source_map, also writes <output>.map (see build_source_map).
+    return assemble_path(path, output_format, source_map)[0]
+
+
+def assemble_path(path: str, output_format: str = 'hack',
+                  source_map: bool = False) -> tuple:
+    # assemble_file() returning (output file path, instruction count)
+    from array import array
+    from writer import FORMATS
+
+    line_numbers = array('i') if source_map else None
+    with open(path, 'r') as asm_file:
+        words = assemble(asm_file, line_numbers=line_numbers)
+
+    extension, write = FORMATS[output_format]
+    output_path = path.replace('.asm', extension)
+    write(output_path, words)
+    if source_map:
+        build_source_map(path, line_numbers).save(output_path + '.map')
+    return output_path, len(words)
+
+
+def build_source_map(path: str, line_numbers):
+    # ROM address -> .asm line map of the program assembled from path,
+    # with the VM commands of <path>.map if the VM translator wrote one
+    import os
+    from source_map import SourceMap
+
+    vm_map_path = path + '.map'
+    if os.path.exists(vm_map_path):
+        return SourceMap.load(vm_map_path).to_rom(line_numbers)
+
+    source_map = SourceMap()
+    source_map.asm_lines = line_numbers
+    return source_map
+
+
+def find_asm_files(paths: Iterable[str]) -> List[str]:
+    # Expands directories (their .asm files) and glob patterns, without
+    # duplicates
+    import glob
+    import os
+
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.asm'))))
+        elif glob.has_magic(path):
+            files.extend(sorted(glob.glob(path, recursive=True)))
+        else:
+            files.append(path)
+    return list(dict.fromkeys(files))
+
+
+def init_worker() -> None:
+    # Imports everything assemble_path() needs once per worker process
+    # instead of once per file. With fork the workers inherit these
+    # modules (and the frozen BASE_TABLE) from the parent.
+    import source_map  # noqa: F401
+    import streaming  # noqa: F401
+    import writer  # noqa: F401
+
+
+def assemble_job(path: str, output_format: str, source_map: bool) -> tuple:
+    # One file of assemble_batch(): (path, output path, instruction
+    # count, error message or None)
+    try:
+        output_path, count = assemble_path(path, output_format, source_map)
+    except Exception as error:
+        return path, None, 0, f'{type(error).__name__}: {error}'
+    return path, output_path, count, None
+
+
+def assemble_batch(paths: Iterable[str], jobs: int = 1,
+                   output_format: str = 'hack',
+                   source_map: bool = False) -> Iterable[tuple]:
+    # Assembles every file of paths in a pool of jobs processes, yielding
+    # assemble_job() results as files complete. A failing file does not
+    # stop the others.
+    init_worker()
+    if jobs <= 1:
+        for path in paths:
+            yield assemble_job(path, output_format, source_map)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=init_worker) as executor:
+        futures = [executor.submit(assemble_job, path, output_format,
+                                   source_map)
+                   for path in paths]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def run_batch(paths: List[str], jobs: int, output_format: str,
+              source_map: bool) -> bool:
+    # Prints a line per file and the totals, returns True if all passed
+    import time
+
+    start = time.perf_counter()
+    instructions = 0
+    failed = 0
+    for path, output_path, count, error in assemble_batch(
+            paths, jobs, output_format, source_map):
+        if error is None:
+            print(f'{path} -> {output_path} ({count} instructions)')
+            instructions += count
+        else:
+            print(f'{path}: {error}')
+            failed += 1
+    elapsed = max(time.perf_counter() - start, 1e-9)
+
+    print(f'Assembled {len(paths) - failed} of {len(paths)} files, '
+          f'{instructions:,} instructions in {elapsed:.2f}s: '
+          f'{len(paths) / elapsed:,.1f} files/s, '
+          f'{instructions / elapsed:,.0f} instructions/s')
+    return failed == 0
+
+
+def assemble_stream(path: str, hack_file_path: str) -> None:
+    from streaming import assemble_lines
     from writer import Writer
-    from translator import Translator
-    from symbol_table import SymbolTable
 
-    # Get arguments
-    arguments = sys.argv[1:]
-    path = arguments[0]
+    hack_file = Writer(hack_file_path)
+    with open(path, 'r') as asm_file:
+        for instruction in assemble_lines(asm_file):
+            hack_file.write_line(format(instruction, '016b'))
 
-    # Load files
-    # Check input file extension
-    assert '.asm' in path, 'File extension must be .asm'
+
+def assemble_classic(path: str, hack_file_path: str) -> None:
+    # Original line-by-line Parser/Translator implementation
+    from parsr import Parser, A_COMMAND, C_COMMAND, L_COMMAND
+    from writer import Writer
+    from translator import Translator
 
     # Open input file
     asm_file = Parser(path)
 
     # Create/open output file
-    hack_file_path = path.replace('.asm', '.hack')
     hack_file = Writer(hack_file_path)
 
     translator = Translator()
@@ -50,5 +194,65 @@ def main():
             address = asm_file.get_symbol()
 
 
+def main():
+    import argparse
+
+    # Get arguments
+    argument_parser = argparse.ArgumentParser(
+        description='Translates Hack .asm files into .hack files.')
+    argument_parser.add_argument(
+        'paths', nargs='+', metavar='path',
+        help='.asm file; several files, directories or glob patterns '
+             'assemble in batch mode')
+    argument_parser.add_argument(
+        '--stream', action='store_true',
+        help='write .hack output while resolving, without holding all '
+             'instructions in memory')
+    argument_parser.add_argument(
+        '--classic', action='store_true',
+        help='use the original line-by-line Parser and Translator')
+    argument_parser.add_argument(
+        '--format', default='hack',
+        choices=['hack', 'bin-le', 'bin-be', 'ihex'],
+        help='output format: text .hack (default), raw little/big-endian '
+             '16-bit words (.bin) or Intel HEX (.hex)')
+    argument_parser.add_argument(
+        '--source-map', action='store_true',
+        help='also write a source map of ROM addresses to .asm (and .vm) '
+             'lines next to the output, e.g. Prog.hack.map')
+    argument_parser.add_argument(
+        '--jobs', type=int, default=1,
+        help='number of processes assembling files in parallel '
+             '(batch mode)')
+    arguments = argument_parser.parse_args()
+
+    import os
+    paths = arguments.paths
+    if len(paths) > 1 or arguments.jobs > 1 or not os.path.isfile(paths[0]):
+        if arguments.classic or arguments.stream:
+            argument_parser.error('--classic and --stream take a single file')
+        files = find_asm_files(paths)
+        if not run_batch(files, arguments.jobs, arguments.format,
+                         arguments.source_map):
+            raise SystemExit(1)
+        return
+
+    path = paths[0]
+    if ((arguments.classic or arguments.stream)
+            and (arguments.format != 'hack' or arguments.source_map)):
+        argument_parser.error('--classic and --stream only write .hack, '
+                              'without a source map')
+
+    # Check input file extension
+    assert '.asm' in path, 'File extension must be .asm'
+
+    if arguments.classic:
+        assemble_classic(path, path.replace('.asm', '.hack'))
+    elif arguments.stream:
+        assemble_stream(path, path.replace('.asm', '.hack'))
+    else:
+        assemble_file(path, arguments.format, arguments.source_map)
+
+
 if __name__ == '__main__':
     main()
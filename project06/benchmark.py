@@ -0,0 +1,233 @@
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+COMPS = ['0', '1', '-1', 'D', 'A', 'M', '!D', 'D+1', 'M-1', 'D+M', 'D-A',
+         'M-D', 'D&M', 'D|A']
+DESTS = ['', 'M=', 'D=', 'MD=', 'A=', 'AM=', 'AD=', 'AMD=']
+JUMPS = ['', ';JGT', ';JEQ', ';JGE', ';JLT', ';JNE', ';JLE', ';JMP']
+
+# Runs assembler.main() in a fresh process and prints its peak RSS
+RUNNER = '''
+import resource, sys, time
+sys.argv = ['assembler.py'] + sys.argv[1:]
+import assembler
+start = time.perf_counter()
+assembler.main()
+print(time.perf_counter() - start,
+      resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+
+def generate_asm(path, num_lines: int, seed: int = 0) -> Path:
+    # Writes a synthetic .asm program with labels, variables and comments
+    # Lines are written as they are generated, so that the benchmark
+    # process stays small (peak RSS is inherited by child processes).
+    rng = random.Random(seed)
+    num_labels = max(1, num_lines // 50)
+    path = Path(path)
+    with open(path, 'w') as f:
+        for i in range(num_lines):
+            choice = rng.random()
+            if choice < 0.02:
+                line = f'(LOOP{i})'
+            elif choice < 0.04:
+                line = f'// comment {i}'
+            elif choice < 0.25:
+                line = f'@LABEL{rng.randrange(num_labels) * 50}'
+            elif choice < 0.35:
+                line = f'@var{rng.randrange(1000)}'
+            elif choice < 0.5:
+                line = f'@{rng.randrange(32768)}'
+            else:
+                line = (rng.choice(DESTS) + rng.choice(COMPS)
+                        + rng.choice(JUMPS))
+            f.write(line + '\n')
+        # every referenced label must exist
+        for i in range(0, num_labels * 50, 50):
+            f.write(f'(LABEL{i})\n')
+    return path
+
+
+def run_assembler(path, *flags) -> tuple:
+    # Returns (seconds, peak RSS in KiB) of one assembler run
+    result = subprocess.run(
+        [sys.executable, '-c', RUNNER, str(path), *flags],
+        cwd=Path(__file__).parent, capture_output=True, text=True,
+        check=True)
+    elapsed, peak = result.stdout.split()[-2:]
+    return float(elapsed), int(peak)
+
+
+def benchmark_translator(num_instructions: int = 1_000_000) -> None:
+    # Compares Translator with the precomputed encoding tables
+    from translator import (Translator, encode_c_instruction, C_PREFIX,
+                            COMP_TABLE, DEST_TABLE, JUMP_TABLE)
+
+    rng = random.Random(0)
+    instructions = [(rng.choice(DESTS)[:-1], rng.choice(COMPS),
+                     rng.choice(JUMPS)[1:])
+                    for _ in range(num_instructions)]
+    lines = [(f'{dest}=' if dest else '') + comp
+             + (f';{jump}' if jump else '')
+             for dest, comp, jump in instructions]
+
+    translator = Translator()
+    start = time.perf_counter()
+    for dest, comp, jump in instructions:
+        translator.construct_c_instruction(
+            translator.translate_comp(comp),
+            translator.translate_dest(dest),
+            translator.translate_jump(jump))
+    elapsed = time.perf_counter() - start
+    print(f'Translator: {num_instructions / elapsed:,.0f} instructions/s')
+
+    start = time.perf_counter()
+    for dest, comp, jump in instructions:
+        C_PREFIX | COMP_TABLE[comp] | DEST_TABLE[dest] | JUMP_TABLE[jump]
+    elapsed = time.perf_counter() - start
+    print(f'tables: {num_instructions / elapsed:,.0f} instructions/s')
+
+    start = time.perf_counter()
+    for line in lines:
+        encode_c_instruction(line)
+    elapsed = time.perf_counter() - start
+    print(f'tables, parsing dest=comp;jump: '
+          f'{num_instructions / elapsed:,.0f} instructions/s')
+
+
+def benchmark_batch(num_files: int = 100, num_lines: int = 2000) -> None:
+    # Compares one assembler process per file with in-process assemble()
+    # and the batch mode
+    import os
+    from assembler import assemble, assemble_batch
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [generate_asm(Path(tmp) / f'Prog{i}.asm', num_lines, seed=i)
+                 for i in range(num_files)]
+
+        start = time.perf_counter()
+        for path in paths:
+            subprocess.run([sys.executable, 'assembler.py', str(path)],
+                           cwd=Path(__file__).parent, check=True)
+        elapsed = time.perf_counter() - start
+        print(f'subprocess per file: {num_files} files in {elapsed:.2f}s')
+
+        start = time.perf_counter()
+        for path in paths:
+            assemble(path.read_text())
+        elapsed = time.perf_counter() - start
+        print(f'in-process assemble(): {num_files} files in {elapsed:.2f}s')
+
+        for jobs in sorted({1, os.cpu_count() or 1}):
+            start = time.perf_counter()
+            instructions = sum(count for _, _, count, _ in assemble_batch(
+                [str(path) for path in paths], jobs))
+            elapsed = time.perf_counter() - start
+            print(f'assemble_batch(jobs={jobs}): {num_files} files in '
+                  f'{elapsed:.2f}s, {num_files / elapsed:,.1f} files/s, '
+                  f'{instructions / elapsed:,.0f} instructions/s')
+
+
+def generate_calls(num_calls: int, num_variables: int = 10_000) -> list:
+    # Lines shaped like VM translator output: every call has its own
+    # $Ret.N return label, so there are num_calls distinct labels
+    lines = []
+    for i in range(num_calls):
+        lines += [f'@Main.f$Ret.{i}', 'D=A', f'@var{i % num_variables}',
+                  'M=D', '@Main.f', '0;JMP', f'(Main.f$Ret.{i})']
+    lines += ['(Main.f)', '@R13', 'A=M', '0;JMP']
+    return lines
+
+
+def benchmark_symbol_table(num_symbols: int = 200_000) -> None:
+    # SymbolTable operations with num_symbols distinct labels
+    from assembler import assemble
+    from symbol_table import SymbolTable
+
+    labels = [f'Main.f$Ret.{i}' for i in range(num_symbols)]
+    variables = [f'var{i}' for i in range(10_000)]
+    symbol_table = SymbolTable()
+
+    def timed(label, function, items):
+        start = time.perf_counter()
+        for item in items:
+            function(item)
+        elapsed = time.perf_counter() - start
+        print(f'{label}: {len(items) / elapsed:,.0f} per second')
+
+    timed('add_label', lambda label: symbol_table.add_label(label, 0), labels)
+    timed('get_or_allocate (label)', symbol_table.get_or_allocate, labels)
+    timed('get_or_allocate (new variable)', symbol_table.get_or_allocate,
+          variables)
+    timed('get_or_allocate (variable)', symbol_table.get_or_allocate,
+          variables)
+
+    base = SymbolTable().snapshot()
+    timed('restore(predefined)', symbol_table.restore, [base] * 100_000)
+    timed('SymbolTable()', lambda _: SymbolTable(), range(100_000))
+
+    lines = generate_calls(num_symbols)
+    start = time.perf_counter()
+    assemble(lines)
+    elapsed = time.perf_counter() - start
+    print(f'assemble(): {num_symbols:,} return labels in {elapsed:.2f}s, '
+          f'{len(lines) / elapsed:,.0f} lines/s')
+
+
+def benchmark_emulator(max_cycles: int = 2_000_000) -> None:
+    # Interpreting and block-compiling emulator speed on the project04
+    # programs
+    from assembler import assemble
+    from block_emulator import BlockEmulator
+    from emulator import Emulator
+    from symbol_table import SymbolTable
+
+    project04 = Path(__file__).resolve().parent.parent / 'project04'
+    programs = [
+        ('Mult.asm', {0: 181, 1: 181}),
+        ('Fill.asm', {}),
+        ('Rectangle.asm', {0: 256}),
+    ]
+    for name, ram in programs:
+        symbol_table = SymbolTable()
+        words = assemble((project04 / name).read_text(), symbol_table)
+        engines = [
+            ('interpreted', Emulator(words)),
+            ('compiled', BlockEmulator(words,
+                                       symbol_table.labels.values())),
+        ]
+        for engine, emulator in engines:
+            total = 0
+            start = time.perf_counter()
+            while total < max_cycles:
+                emulator.reset()
+                for address, value in ram.items():
+                    emulator.ram[address] = value
+                total += emulator.run(max_cycles - total)
+            elapsed = time.perf_counter() - start
+            print(f'{name} ({engine}): {total / elapsed:,.0f} cycles/s')
+
+
+def main() -> None:
+    num_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = generate_asm(Path(tmp) / 'Bench.asm', num_lines)
+        for label, flags in [('classic', ['--classic']),
+                             ('stream', ['--stream']), ('default', [])]:
+            elapsed, peak = run_assembler(path, *flags)
+            print(f'{label}: {num_lines} lines in {elapsed:.2f}s, '
+                  f'peak RSS {peak / 1024:.1f} MiB')
+
+    # run last, they grow this process (peak RSS is inherited)
+    benchmark_translator()
+    benchmark_batch()
+    benchmark_symbol_table()
+    benchmark_emulator()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+# block_emulator.py
+# Hack emulator that compiles basic blocks into Python functions.
+#
+# A block starts at the address where execution enters it and runs up
+# to an unconditional jump, the next block leader (label address) or
+# MAX_BLOCK_SIZE instructions; a conditional jump leaves the block only
+# when it is taken. The instructions are turned into Python source and
+# compiled with compile(): registers become locals, M is accessed as
+# ram[Xxx] directly while A holds a value known at compile time (after
+# @Xxx), constant expressions are folded, results are only wrapped to
+# 16 bits where their range can overflow, and assignments to A or D
+# that are overwritten before being read are dropped. Blocks are
+# compiled when first reached and cached by start address; the ROM
+# cannot change, so the cache never needs invalidating.
+from typing import Iterable
+from emulator import Emulator
+from translator import COMP_TABLE
+
+MAX_BLOCK_SIZE = 256
+
+# comp bits -> mnemonic, first listed spelling wins
+COMP_MNEMONICS = {}
+for _mnemonic, _bits in COMP_TABLE.items():
+    COMP_MNEMONICS.setdefault(_bits, _mnemonic)
+
+# comps whose result can leave the signed 16-bit range
+WRAPPING_COMPS = {'-D', '-A', '-M', 'D+1', 'A+1', 'M+1', 'D-1', 'A-1',
+                  'M-1', 'D+A', 'D+M', 'D-A', 'D-M', 'A-D', 'M-D',
+                  'A+D', 'M+D'}
+
+WORD_MIN = -32768
+WORD_MAX = 32767
+
+JUMP_CONDITIONS = {
+    0b001: '> 0',
+    0b010: '== 0',
+    0b011: '>= 0',
+    0b100: '< 0',
+    0b101: '!= 0',
+    0b110: '<= 0',
+}
+
+
+class BlockEmulator(Emulator):
+    def __init__(self, words: Iterable[int],
+                 leaders: Iterable[int] = ()) -> None:
+        # leaders are addresses where blocks must end, e.g. the
+        # ROM addresses of labels (SymbolTable.labels.values())
+        super().__init__(words)
+        # a list indexes much faster than array('h'); generated code
+        # keeps every value in the signed 16-bit range
+        self.ram = [0] * len(self.ram)
+        self.leaders = set(leaders)
+        self.blocks = {}  # start address -> compiled block
+
+    def run(self, max_cycles: int) -> int:
+        # Runs whole blocks until at least max_cycles instructions were
+        # executed, a halt loop is reached or the PC leaves the program.
+        # Returns the number of cycles executed by this call.
+        # A block returns (pc, A, D, cycles); pc is -1 - address when it
+        # reached the halt loop at address.
+        blocks = self.blocks
+        ram = self.ram
+        size = len(self.program)
+        pc, a, d = self.pc, self.a, self.d
+        cycles = 0
+
+        while cycles < max_cycles:
+            try:
+                block = blocks[pc]
+            except KeyError:
+                if not 0 <= pc < size:
+                    break
+                block = self.compile_block(pc)
+            pc, a, d, executed = block(ram, a, d)
+            cycles += executed
+
+        if pc < 0:
+            pc = -1 - pc
+            self.halted = True
+        elif pc >= size:
+            self.halted = True
+        self.pc, self.a, self.d = pc, a, d
+        self.cycles += cycles
+        return cycles
+
+    def compile_block(self, start: int):
+        generator = BlockGenerator()
+        address = start
+
+        while address < len(self.program):
+            instruction = self.program[address]
+            if instruction.__class__ is int:
+                generator.load_a(instruction)
+            elif generator.c_instruction(self.rom[address], address,
+                                         address - start + 1,
+                                         instruction[5]):
+                address += 1
+                break
+            address += 1
+
+            if address in self.leaders or address - start >= MAX_BLOCK_SIZE:
+                generator.exit(address, address - start)
+                break
+        else:
+            generator.exit(address, address - start)
+
+        source = generator.source()
+        namespace = {}
+        exec(compile(source, f'<block {start}>', 'exec'), namespace)
+        self.blocks[start] = namespace['block']
+        return namespace['block']
+
+
+class BlockGenerator:
+    # Builds the Python source of one block
+
+    def __init__(self) -> None:
+        self.lines = ['def block(ram, A, D):']
+        self.known = {'A': None, 'D': None}  # values known at compile time
+        self.pending = {'A': None, 'D': None}  # unread assignments
+
+    def source(self) -> str:
+        return '\n'.join(line for line in self.lines if line is not None)
+
+    def read(self, registers: str) -> None:
+        for register in 'AD':
+            if register in registers:
+                self.pending[register] = None
+
+    def assign(self, register: str, expression: str, known=None) -> None:
+        # an assignment overwritten before being read is dropped
+        if self.pending[register] is not None:
+            self.lines[self.pending[register]] = None
+        self.lines.append(f'    {register} = {expression}')
+        self.pending[register] = len(self.lines) - 1
+        self.known[register] = known
+
+    def exit(self, pc, cycles: int, indent: str = '    ') -> None:
+        self.read('AD')
+        self.lines.append(f'{indent}return {pc}, A, D, {cycles}')
+
+    def load_a(self, value: int) -> None:
+        self.assign('A', str(value), value)
+
+    def memory(self) -> str:
+        # RAM has exactly 32K words, so for any signed 16-bit A,
+        # ram[A] is the same word as ram[A & 32767]
+        if self.known['A'] is not None:
+            return f'ram[{self.known["A"]}]'
+        self.read('A')
+        return 'ram[A]'
+
+    def operand(self, register: str) -> str:
+        if self.known[register] is not None:
+            return f'({self.known[register]})'
+        self.read(register)
+        return register
+
+    def wrap(self, mnemonic: str):
+        # Returns the statement bringing value back into 16 bits, or
+        # None if the result cannot overflow. The bounds of the result
+        # are found by evaluating the (linear) comp on the bounds of
+        # its operands.
+        bounds = {}
+        for register in 'ADM':
+            value = self.known.get(register)
+            bounds[register] = (value, value) if value is not None \
+                else (WORD_MIN, WORD_MAX)
+
+        results = [eval(mnemonic, {}, {'A': a, 'D': d, 'M': m})
+                   for a in bounds['A'] for d in bounds['D']
+                   for m in bounds['M']]
+        low, high = min(results), max(results)
+
+        if low >= WORD_MIN and high <= WORD_MAX:
+            return None
+        if low >= WORD_MIN:
+            return 'if value > 32767: value -= 65536'
+        if high <= WORD_MAX:
+            return 'if value < -32768: value += 65536'
+        return 'value = (value + 32768 & 65535) - 32768'
+
+    def c_instruction(self, word: int, address: int, cycles: int,
+                      halts: bool) -> bool:
+        # Appends the code of one C instruction.
+        # Returns True if it ends the block (unconditional jump).
+        mnemonic = COMP_MNEMONICS[word & 0x1FC0]
+        jump = word & 0b111
+
+        if jump and halts:
+            self.exit(-1 - address, cycles)
+            return True
+
+        # the jump target is A before this instruction writes it
+        if jump:
+            if self.known['A'] is not None:
+                target = str(self.known['A'] & 0x7FFF)
+            else:
+                self.read('A')
+                self.lines.append('    target = A & 32767')
+                target = 'target'
+
+        dests = [dest for bit, dest in
+                 [(0b001000, 'M'), (0b010000, 'D'), (0b100000, 'A')]
+                 if word & bit]
+        if not dests and jump == 0b111:
+            self.exit(target, cycles)
+            return True
+
+        expression = ''.join(
+            self.memory() if c == 'M' else '~' if c == '!'
+            else self.operand(c) if c in 'AD' else c
+            for c in mnemonic)
+
+        known = None
+        wrap = None
+        if 'M' not in mnemonic and all(
+                self.known.get(c, 0) is not None for c in mnemonic):
+            known = eval(expression)  # only constants are left
+            known = (known - WORD_MIN & 0xFFFF) + WORD_MIN
+            expression = str(known)
+        elif mnemonic in WRAPPING_COMPS:
+            wrap = self.wrap(mnemonic)
+
+        if len(dests) == 1 and jump in (0, 0b111) and wrap is None:
+            value = expression
+        else:
+            self.lines.append(f'    value = {expression}')
+            if wrap is not None:
+                self.lines.append(f'    {wrap}')
+            value = 'value'
+
+        if 'M' in dests:
+            self.lines.append(f'    {self.memory()} = {value}')
+        if 'D' in dests:
+            self.assign('D', value, known)
+        if 'A' in dests:
+            self.assign('A', value, known)
+
+        if jump == 0b111:
+            self.exit(target, cycles)
+            return True
+        if jump:
+            self.read('AD')
+            self.lines.append(f'    if value {JUMP_CONDITIONS[jump]}:')
+            self.exit(target, cycles, indent='        ')
+        return False
@@ -0,0 +1,163 @@
+# emulator.py
+# Hack computer emulator.
+#
+# The ROM is predecoded once: an A instruction becomes its int value,
+# a C instruction becomes a tuple (comp, write_m, write_d, write_a,
+# jump, halts), where comp is a function of (A, D, M). The execution
+# loop therefore never parses or decodes an instruction.
+from array import array
+from typing import Iterable
+from translator import COMP_TABLE
+
+ROM_SIZE = 32768
+RAM_SIZE = 32768
+
+
+def build_comp_functions() -> dict:
+    # comp bits (a-bit included) -> function of (A, D, M)
+    functions = {}
+    for mnemonic, bits in COMP_TABLE.items():
+        if bits not in functions:
+            expression = mnemonic.replace('!', '~')
+            functions[bits] = eval(f'lambda A, D, M: {expression}')
+    return functions
+
+
+COMP_FUNCTIONS = build_comp_functions()
+
+
+class Emulator:
+    def __init__(self, words: Iterable[int]) -> None:
+        self.rom = array('H', words)
+        if len(self.rom) > ROM_SIZE:
+            raise ValueError(f'{len(self.rom)} instructions do not fit '
+                             f'in the {ROM_SIZE} word ROM.')
+        self.ram = array('h', bytes(2 * RAM_SIZE))
+        self.program = self.decode()
+        self.reset()
+
+    def reset(self) -> None:
+        self.pc = 0
+        self.a = 0
+        self.d = 0
+        self.cycles = 0
+        self.halted = False
+
+    def decode(self) -> list:
+        program = []
+        for address, word in enumerate(self.rom):
+            if word < 0x8000:  # A instruction
+                program.append(word)
+                continue
+
+            comp = COMP_FUNCTIONS.get(word & 0x1FC0)
+            if comp is None:
+                raise ValueError(f'{word:016b} at ROM[{address}] is an '
+                                 f'invalid instruction.')
+            jump = word & 0b111
+            # (X) @X 0;JMP is a halt loop
+            halts = (jump == 0b111 and address > 0
+                     and self.rom[address - 1] == address - 1)
+            program.append((comp, bool(word & 0b001000),
+                            bool(word & 0b010000), bool(word & 0b100000),
+                            jump, halts))
+
+        return program
+
+    def run(self, max_cycles: int) -> int:
+        # Runs until max_cycles instructions were executed, a halt loop is
+        # reached or the program counter leaves the program.
+        # Returns the number of cycles executed by this call.
+        program = self.program
+        ram = self.ram
+        size = len(program)
+        pc, a, d = self.pc, self.a, self.d
+        cycles = 0
+
+        while cycles < max_cycles and pc < size:
+            cycles += 1
+            instruction = program[pc]
+            if instruction.__class__ is int:
+                a = instruction
+                pc += 1
+                continue
+
+            comp, write_m, write_d, write_a, jump, halts = instruction
+            value = (comp(a, d, ram[a & 0x7FFF]) + 0x8000 & 0xFFFF) - 0x8000
+
+            if jump and ((jump & 0b100 and value < 0)
+                         or (jump & 0b010 and value == 0)
+                         or (jump & 0b001 and value > 0)):
+                if halts:
+                    self.halted = True
+                    break
+                next_pc = a & 0x7FFF
+            else:
+                next_pc = pc + 1
+
+            if write_m:
+                ram[a & 0x7FFF] = value
+            if write_d:
+                d = value
+            if write_a:
+                a = value
+            pc = next_pc
+
+        if pc >= size:
+            self.halted = True
+        self.pc, self.a, self.d = pc, a, d
+        self.cycles += cycles
+        return cycles
+
+
+def load_hack(path: str) -> list:
+    # Reads a textual .hack file into a list of instructions
+    with open(path, 'r') as f:
+        return [int(line, 2) for line in f if line.strip()]
+
+
+def main():
+    import argparse
+
+    argument_parser = argparse.ArgumentParser(
+        description='Runs a Hack program and prints the machine state.')
+    argument_parser.add_argument('path', help='.hack or .asm file')
+    argument_parser.add_argument('--cycles', type=int, default=1_000_000,
+                                 help='maximum number of cycles to run')
+    argument_parser.add_argument('--ram', nargs='*', default=[],
+                                 metavar='ADDRESS=VALUE',
+                                 help='initial RAM contents')
+    argument_parser.add_argument(
+        '--compile', action='store_true',
+        help='compile basic blocks into Python functions (faster for '
+             'long runs)')
+    arguments = argument_parser.parse_args()
+
+    leaders = ()
+    if arguments.path.endswith('.asm'):
+        from assembler import assemble
+        from symbol_table import SymbolTable
+        symbol_table = SymbolTable()
+        with open(arguments.path, 'r') as asm_file:
+            words = assemble(asm_file, symbol_table)
+        leaders = symbol_table.labels.values()
+    else:
+        words = load_hack(arguments.path)
+
+    if arguments.compile:
+        from block_emulator import BlockEmulator
+        emulator = BlockEmulator(words, leaders)
+    else:
+        emulator = Emulator(words)
+    for assignment in arguments.ram:
+        address, value = assignment.split('=')
+        emulator.ram[int(address)] = int(value)
+
+    emulator.run(arguments.cycles)
+    print(f'{emulator.cycles} cycles, '
+          f'{"halted" if emulator.halted else "running"} at PC={emulator.pc}')
+    print('RAM[0..15]:', list(emulator.ram[0:16]))
+
+
+if __name__ == '__main__':
+    main()
@@ -89,8 +89,7 @@ class Parser:
                 if clean_line[0] == '(':
                     address_only = clean_line[1:-1]
                     if not address_only.isdigit():
-                        self.symbol_table.add_entry(
-                            symbol=address_only, address=i)
+                        self.symbol_table.add_label(address_only, i)
                 else:
                     i += 1
 
@@ -109,19 +108,14 @@ class Parser:
 
         if address_only.isdigit():
             address_dec = int(address_only)
+        elif c_type == L_COMMAND:
+            address_dec = self.symbol_table.add_label(
+                address_only, self.line_index)
         else:
-            if self.symbol_table.contains(address_only):
-                address_dec = self.symbol_table.get_address(address_only)
-            else:
-                if c_type == L_COMMAND:
-                    address_dec = self.symbol_table.add_entry(
-                        symbol=address_only, address=self.line_index)
-                else:
-                    address_dec = self.symbol_table.add_entry(
-                        symbol=address_only)
+            address_dec = self.symbol_table.get_or_allocate(address_only)
 
         # Returns binary conversion of address_dec w/0 '0b' at beginning
-        return format(int(address_dec), '015b')
+        return format(address_dec, '015b')
 
     # Returns dest mnemonic. Called only if command_type is C_COMMAND
     def get_dest(self) -> str:
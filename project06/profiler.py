@@ -0,0 +1,257 @@
+# profiler.py
+# Cycle profiler for Hack programs.
+#
+# ProfilingEmulator counts the executions of every ROM address in a
+# flat array. The counts are rolled up to labels and, for programs
+# written by the VM translator, to VM functions and VM commands: the
+# translator writes a '// <command>' comment before the code of every
+# VM command, so asm_source_map() can tell which command each ROM
+# address belongs to. If the translator also wrote a source map
+# (Prog.asm.map), counts are rolled up to .vm lines as well, and labels
+# shortened with --short-labels are shown by their names in Prog.labels.
+from array import array
+from bisect import bisect_right
+from emulator import Emulator
+
+BOOTSTRAP = '(bootstrap)'
+
+
+class ProfilingEmulator(Emulator):
+    # Emulator whose run() also counts executions per ROM address.
+    # Kept as a separate loop so that Emulator.run() pays nothing.
+
+    def __init__(self, words) -> None:
+        super().__init__(words)
+        self.counts = array('Q', bytes(8 * len(self.program)))
+
+    def run(self, max_cycles: int) -> int:
+        program = self.program
+        ram = self.ram
+        counts = self.counts
+        size = len(program)
+        pc, a, d = self.pc, self.a, self.d
+        cycles = 0
+
+        while cycles < max_cycles and pc < size:
+            cycles += 1
+            counts[pc] += 1
+            instruction = program[pc]
+            if instruction.__class__ is int:
+                a = instruction
+                pc += 1
+                continue
+
+            comp, write_m, write_d, write_a, jump, halts = instruction
+            value = (comp(a, d, ram[a & 0x7FFF]) + 0x8000 & 0xFFFF) - 0x8000
+
+            if jump and ((jump & 0b100 and value < 0)
+                         or (jump & 0b010 and value == 0)
+                         or (jump & 0b001 and value > 0)):
+                if halts:
+                    self.halted = True
+                    break
+                next_pc = a & 0x7FFF
+            else:
+                next_pc = pc + 1
+
+            if write_m:
+                ram[a & 0x7FFF] = value
+            if write_d:
+                d = value
+            if write_a:
+                a = value
+            pc = next_pc
+
+        if pc >= size:
+            self.halted = True
+        self.pc, self.a, self.d = pc, a, d
+        self.cycles += cycles
+        return cycles
+
+
+def asm_source_map(lines) -> tuple:
+    # Returns (owners, commands). commands lists (asm line number, VM
+    # command, VM function) for every '// command' comment; owners[k]
+    # is the index in commands of the command ROM address k belongs to,
+    # or -1 for code before the first command (the bootstrap).
+    # Shared routines of compact mode ($$CALL, ...) count as functions.
+    owners = array('i')
+    commands = []
+    function = BOOTSTRAP
+    current = -1
+
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('//'):
+            command = line[2:].strip()
+            if command.startswith('function '):
+                function = command.split()[1]
+            commands.append((number, command, function))
+            current = len(commands) - 1
+        elif line[0] == '(':
+            if line.startswith('($$'):
+                function = line[1:-1]
+                commands.append((number, function, function))
+                current = len(commands) - 1
+        else:
+            owners.append(current)
+    return owners, commands
+
+
+class Profile:
+    # Execution counts of one run, rolled up in different ways. Each
+    # by_*() method returns (name, cycles) pairs, most cycles first.
+
+    def __init__(self, counts, labels: dict = None, owners=None,
+                 commands=None, source_map=None) -> None:
+        self.counts = counts
+        self.total = sum(counts)
+        self.labels = sorted((address, label)
+                             for label, address in (labels or {}).items())
+        self.owners = owners
+        self.commands = commands
+        self.source_map = source_map  # keyed by ROM address
+
+    def by_address(self) -> list:
+        return sorted(((address, count)
+                       for address, count in enumerate(self.counts) if count),
+                      key=lambda item: -item[1])
+
+    def by_label(self) -> list:
+        # each address counts for the closest label before it
+        addresses = [address for address, _ in self.labels]
+        totals = {}
+        for address, count in enumerate(self.counts):
+            if count:
+                index = bisect_right(addresses, address) - 1
+                label = self.labels[index][1] if index >= 0 else BOOTSTRAP
+                totals[label] = totals.get(label, 0) + count
+        return sorted(totals.items(), key=lambda item: -item[1])
+
+    def by_function(self) -> list:
+        totals = {}
+        for owner, count in zip(self.owners, self.counts):
+            if count:
+                function = (self.commands[owner][2] if owner >= 0
+                            else BOOTSTRAP)
+                totals[function] = totals.get(function, 0) + count
+        return sorted(totals.items(), key=lambda item: -item[1])
+
+    def by_command(self) -> list:
+        # names are 'asm line: command (function)'
+        totals = {}
+        for owner, count in zip(self.owners, self.counts):
+            if count:
+                totals[owner] = totals.get(owner, 0) + count
+        result = []
+        for owner, count in totals.items():
+            if owner >= 0:
+                number, command, function = self.commands[owner]
+                result.append((f'{number}: {command} ({function})', count))
+            else:
+                result.append((BOOTSTRAP, count))
+        return sorted(result, key=lambda item: -item[1])
+
+    def by_vm_line(self) -> list:
+        # names are 'file:line (function)'
+        totals = {}
+        for address, count in enumerate(self.counts):
+            if count:
+                source = self.source_map.lookup(address)
+                if source is None:
+                    name = BOOTSTRAP
+                elif source[0] is None:  # shared routine
+                    name = source[2]
+                else:
+                    name = f'{source[0]}:{source[1]} ({source[2]})'
+                totals[name] = totals.get(name, 0) + count
+        return sorted(totals.items(), key=lambda item: -item[1])
+
+    def table(self, title: str, rows: list, limit: int = 20) -> str:
+        lines = [f'{title:<48} {"cycles":>12} {"%":>6}']
+        for name, count in rows[:limit]:
+            lines.append(f'{str(name)[:48]:<48} {count:>12,} '
+                         f'{100 * count / self.total:>6.2f}')
+        return '\n'.join(lines)
+
+
+def read_label_names(path: str) -> dict:
+    # short label -> readable name, from a 'short name' per line file
+    with open(path, 'r') as f:
+        return dict(line.split() for line in f if line.strip())
+
+
+def profile_file(path: str, max_cycles: int, ram: dict = None) -> tuple:
+    # Assembles and runs the .asm file at path. Returns (emulator,
+    # Profile).
+    import os
+    from assembler import assemble
+    from source_map import SourceMap
+    from symbol_table import SymbolTable
+
+    with open(path, 'r') as asm_file:
+        lines = asm_file.readlines()
+    symbol_table = SymbolTable()
+    line_numbers = array('i')
+    emulator = ProfilingEmulator(assemble(lines, symbol_table, line_numbers))
+    for address, value in (ram or {}).items():
+        emulator.ram[address] = value
+    emulator.run(max_cycles)
+
+    source_map = None
+    if os.path.exists(path + '.map'):
+        source_map = SourceMap.load(path + '.map').to_rom(line_numbers)
+
+    labels = symbol_table.labels
+    names_path = os.path.splitext(path)[0] + '.labels'
+    if os.path.exists(names_path):
+        names = read_label_names(names_path)
+        labels = {names.get(label, label): address
+                  for label, address in labels.items()}
+
+    owners, commands = asm_source_map(lines)
+    return emulator, Profile(emulator.counts, labels, owners, commands,
+                             source_map)
+
+
+def main():
+    import argparse
+
+    argument_parser = argparse.ArgumentParser(
+        description='Runs a Hack .asm program and prints where its cycles '
+                    'were spent.')
+    argument_parser.add_argument('path', help='.asm file')
+    argument_parser.add_argument('--cycles', type=int, default=10_000_000,
+                                 help='maximum number of cycles to run')
+    argument_parser.add_argument('--ram', nargs='*', default=[],
+                                 metavar='ADDRESS=VALUE',
+                                 help='initial RAM contents')
+    argument_parser.add_argument('--top', type=int, default=20,
+                                 help='rows per table')
+    arguments = argument_parser.parse_args()
+
+    ram = {}
+    for assignment in arguments.ram:
+        address, value = assignment.split('=')
+        ram[int(address)] = int(value)
+
+    emulator, profile = profile_file(arguments.path, arguments.cycles, ram)
+    print(f'{emulator.cycles:,} cycles, '
+          f'{"halted" if emulator.halted else "running"} at PC={emulator.pc}')
+    print()
+    print(profile.table('function', profile.by_function(), arguments.top))
+    print()
+    print(profile.table('VM command', profile.by_command(), arguments.top))
+    print()
+    if profile.source_map is not None:
+        print(profile.table('VM line', profile.by_vm_line(), arguments.top))
+        print()
+    print(profile.table('label', profile.by_label(), arguments.top))
+    print()
+    print(profile.table('ROM address', profile.by_address(), arguments.top))
+
+
+if __name__ == '__main__':
+    main()
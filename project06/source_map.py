@@ -0,0 +1,159 @@
+# source_map.py
+# Source maps from Hack code back to .asm and .vm lines.
+#
+# A SourceMap holds
+# - asm_lines: the .asm line number of every ROM address (may be empty)
+# - ranges of VM commands: starts[k] is where the code of command k
+#   begins, vm_files[k], vm_lines[k] and functions[k] say where it came
+#   from (indices into names, -1 for none)
+# Ranges are keyed by ROM address, or by .asm line for the maps the VM
+# translator writes next to its .asm output (keyed_by == ASM_LINE).
+# Lookups are a list index for the .asm line and a binary search of
+# starts for the VM command.
+#
+# Sidecar file layout, little-endian: b'HMAP', u16 version, u16 key
+# kind, u32 number of names, the names (u16 length + UTF-8), then the
+# u32 length and the int32 items of asm_lines, starts, vm_files,
+# vm_lines and functions.
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+
+MAGIC = b'HMAP'
+VERSION = 1
+
+ROM_ADDRESS = 0
+ASM_LINE = 1
+
+
+class SourceMap:
+    def __init__(self, keyed_by: int = ROM_ADDRESS) -> None:
+        self.keyed_by = keyed_by
+        self.asm_lines = array('i')
+        self.starts = array('i')
+        self.vm_files = array('i')
+        self.vm_lines = array('i')
+        self.functions = array('i')
+        self.names = []
+        self.name_indices = {}
+
+    def name_index(self, name) -> int:
+        if name is None:
+            return -1
+        index = self.name_indices.get(name)
+        if index is None:
+            index = len(self.names)
+            self.names.append(name)
+            self.name_indices[name] = index
+        return index
+
+    def add_range(self, start: int, vm_file, vm_line: int,
+                  function) -> None:
+        # ranges must be added in order of start
+        self.starts.append(start)
+        self.vm_files.append(self.name_index(vm_file))
+        self.vm_lines.append(vm_line)
+        self.functions.append(self.name_index(function))
+
+    @classmethod
+    def from_sources(cls, sources, asm_lines=None) -> 'SourceMap':
+        # sources are (.asm line index, vm file, vm line, function)
+        # tuples in order, as recorded by CodeWriter. Without asm_lines
+        # the map is keyed by .asm line; with the .asm line of every ROM
+        # address (increasing, from the assembler) it is keyed by ROM
+        # address.
+        if asm_lines is None:
+            source_map = cls(ASM_LINE)
+        else:
+            source_map = cls(ROM_ADDRESS)
+            source_map.asm_lines = array('i', asm_lines)
+
+        for index, vm_file, vm_line, function in sources:
+            start = index + 1  # line numbers start at 1
+            if asm_lines is not None:
+                # first instruction at or after the command's first line
+                start = bisect_left(source_map.asm_lines, start)
+            source_map.add_range(start, vm_file, vm_line, function)
+        return source_map
+
+    def to_rom(self, asm_lines) -> 'SourceMap':
+        # Converts a map keyed by .asm line into one keyed by ROM address
+        names = self.names
+        sources = [(start - 1,
+                    names[vm_file] if vm_file >= 0 else None, vm_line,
+                    names[function] if function >= 0 else None)
+                   for start, vm_file, vm_line, function
+                   in zip(self.starts, self.vm_files, self.vm_lines,
+                          self.functions)]
+        return SourceMap.from_sources(sources, asm_lines)
+
+    def asm_line(self, address: int):
+        if 0 <= address < len(self.asm_lines):
+            return self.asm_lines[address]
+        return None
+
+    def lookup(self, key: int):
+        # Returns (vm file, vm line, function) of the VM command key
+        # (a ROM address or .asm line) belongs to, or None
+        index = bisect_right(self.starts, key) - 1
+        if index < 0:
+            return None
+        vm_file = self.vm_files[index]
+        function = self.functions[index]
+        return (self.names[vm_file] if vm_file >= 0 else None,
+                self.vm_lines[index],
+                self.names[function] if function >= 0 else None)
+
+    def to_bytes(self) -> bytes:
+        parts = [MAGIC, struct.pack('<HHI', VERSION, self.keyed_by,
+                                    len(self.names))]
+        for name in self.names:
+            encoded = name.encode()
+            parts.append(struct.pack('<H', len(encoded)) + encoded)
+        for items in (self.asm_lines, self.starts, self.vm_files,
+                      self.vm_lines, self.functions):
+            items = array('i', items)
+            if sys.byteorder == 'big':
+                items.byteswap()
+            parts.append(struct.pack('<I', len(items)) + items.tobytes())
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'SourceMap':
+        if data[:4] != MAGIC:
+            raise ValueError('Not a source map.')
+        version, keyed_by, num_names = struct.unpack_from('<HHI', data, 4)
+        if version != VERSION:
+            raise ValueError(f'Unsupported source map version {version}.')
+
+        source_map = cls(keyed_by)
+        offset = 12
+        for _ in range(num_names):
+            length, = struct.unpack_from('<H', data, offset)
+            offset += 2
+            source_map.name_index(data[offset:offset + length].decode())
+            offset += length
+
+        tables = []
+        for _ in range(5):
+            length, = struct.unpack_from('<I', data, offset)
+            offset += 4
+            items = array('i')
+            items.frombytes(data[offset:offset + 4 * length])
+            if sys.byteorder == 'big':
+                items.byteswap()
+            tables.append(items)
+            offset += 4 * length
+        (source_map.asm_lines, source_map.starts, source_map.vm_files,
+         source_map.vm_lines, source_map.functions) = tables
+        return source_map
+
+    def save(self, path) -> None:
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path) -> 'SourceMap':
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
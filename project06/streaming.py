@@ -0,0 +1,80 @@
+# streaming.py
+# Two-pass assembler built on a generator pipeline.
+#
+# The first pass reads the source one line at a time, records label
+# addresses in the symbol table and turns every instruction into a
+# compact record: an int in an array('i'). A record >= 0 is a finished
+# 16-bit instruction (C commands and numeric A commands are encoded
+# right away); a record < 0 is an A command referring to the symbol
+# with index -record - 1. The second pass only resolves those symbols,
+# so the text is parsed once and never held in memory as a whole.
+from array import array
+from typing import Iterable, Iterator
+from symbol_table import SymbolTable
+from translator import encode_c_instruction
+
+
+def tokenize(lines: Iterable[str], symbol_table: SymbolTable,
+             symbols: dict, line_numbers: array = None) -> array:
+    # First pass. Returns the instruction records and fills symbols
+    # with every referenced symbol, mapped to its index. If given,
+    # line_numbers receives the source line number of every instruction.
+    records = array('i')
+    c_instructions = {}  # instruction text -> encoded instruction
+
+    for number, line in enumerate(lines, 1):
+        line = line.split('//')[0].strip()
+        if not line:
+            continue
+        if line_numbers is not None and line[0] != '(':
+            line_numbers.append(number)
+
+        if line[0] == '(':
+            label = line[1:-1]
+            if not label.isdigit():
+                symbol_table.add_label(label, len(records))
+        elif line[0] == '@':
+            value = line[1:]
+            if value.isdigit():
+                records.append(int(value))
+            else:
+                index = symbols.setdefault(value, len(symbols))
+                records.append(-index - 1)
+        else:
+            word = c_instructions.get(line)
+            if word is None:
+                word = encode_c_instruction(line)
+                c_instructions[line] = word
+            records.append(word)
+
+    return records
+
+
+def resolve(records: array, symbol_table: SymbolTable,
+            symbols: dict) -> Iterator[int]:
+    # Second pass. Yields the final instructions in ROM order.
+    # Variables get RAM addresses in order of first use.
+    names = list(symbols)
+    addresses = [None] * len(names)
+
+    for record in records:
+        if record >= 0:
+            yield record
+            continue
+
+        index = -record - 1
+        address = addresses[index]
+        if address is None:
+            address = symbol_table.get_or_allocate(names[index])
+            addresses[index] = address
+        yield address
+
+
+def assemble_lines(lines: Iterable[str], symbol_table: SymbolTable = None,
+                   line_numbers: array = None) -> Iterator[int]:
+    # symbol_table collects labels and variables if given
+    if symbol_table is None:
+        symbol_table = SymbolTable()
+    symbols = {}
+    records = tokenize(lines, symbol_table, symbols, line_numbers)
+    return resolve(records, symbol_table, symbols)
@@ -1,58 +1,83 @@
 # Creates dictionary of symbol labels
 # and their corresponding numeric addresses
+#
+# Addresses are ints. labels holds the (Xxx) labels and their ROM
+# addresses, variables the @xxx variables and their RAM addresses;
+# predefined symbols are in neither. addresses merges all three, so
+# that resolving a symbol is a single dict probe.
+from types import MappingProxyType
+
+
 class SymbolTable:
     def __init__(self) -> None:
-        self.symbol_dict = self.base_table()
-        self.ram_position = 16  # 0-15 have preset values
+        self.restore(BASE_SNAPSHOT)
+
+    def get_address(self, symbol: str) -> int:
+        return self.addresses[symbol]
+
+    def contains(self, symbol: str) -> bool:
+        return symbol in self.addresses
 
-    def get_address(self, symbol: str) -> str:
-        address = self.symbol_dict[symbol]
+    def get_or_allocate(self, symbol: str) -> int:
+        # Address of symbol, a new variable if it is not known yet
+        address = self.addresses.get(symbol)
         if address is None:
-            return ''
+            address = self.ram_position
+            self.ram_position += 1
+            self.addresses[symbol] = address
+            self.variables[symbol] = address
+        return address
 
-        return self.symbol_dict[symbol]
+    def add_label(self, symbol: str, address: int) -> int:
+        # The first definition of a symbol wins
+        known = self.addresses.get(symbol)
+        if known is not None:
+            return known
+        self.addresses[symbol] = address
+        self.labels[symbol] = address
+        return address
 
-    def contains(self, symbol: str) -> bool:
-        return symbol in self.symbol_dict
+    def snapshot(self) -> tuple:
+        # State that restore() returns to. The tables are copied, so the
+        # snapshot does not change when symbols are added later.
+        return (dict(self.addresses), dict(self.labels),
+                dict(self.variables), self.ram_position)
 
-    def add_entry(self, symbol: str, address: str = None) -> str:
-        if self.contains(symbol):
-            return self.get_address(symbol)
+    def restore(self, snapshot: tuple) -> None:
+        addresses, labels, variables, self.ram_position = snapshot
+        self.addresses = dict(addresses)
+        self.labels = dict(labels)  # ROM addresses of (Xxx) labels
+        self.variables = dict(variables)  # RAM addresses of variables
 
-        if address is None:
-            address = -1
-            if self.contains(symbol):
-                address = self.symbol_dict[symbol]
-            if address == -1:
-                address = self.ram_position
-                self.ram_position += 1
-
-        self.symbol_dict[symbol] = address
-        return self.get_address(symbol)
-
-    def base_table(self):  # 15-bit addresses, 32K locations
-        return {
-            'SP': '0',
-            'LCL': '1',
-            'ARG': '2',
-            'THIS': '3',
-            'THAT': '4',
-            'R0': '0',
-            'R1': '1',
-            'R2': '2',
-            'R3': '3',
-            'R4': '4',
-            'R5': '5',
-            'R6': '6',
-            'R7': '7',
-            'R8': '8',
-            'R9': '9',
-            'R10': '10',
-            'R11': '11',
-            'R12': '12',
-            'R13': '13',
-            'R14': '14',
-            'R15': '15',
-            'SCREEN': '16384',
-            'KBD': '24576',
-        }
+
+# Predefined symbols. Read-only, so that it can be shared by batch
+# workers.
+BASE_TABLE = MappingProxyType({  # 15-bit addresses, 32K locations
+    'SP': 0,
+    'LCL': 1,
+    'ARG': 2,
+    'THIS': 3,
+    'THAT': 4,
+    'R0': 0,
+    'R1': 1,
+    'R2': 2,
+    'R3': 3,
+    'R4': 4,
+    'R5': 5,
+    'R6': 6,
+    'R7': 7,
+    'R8': 8,
+    'R9': 9,
+    'R10': 10,
+    'R11': 11,
+    'R12': 12,
+    'R13': 13,
+    'R14': 14,
+    'R15': 15,
+    'SCREEN': 16384,
+    'KBD': 24576,
+})
+
+# State of a new table, built once per process. A plain dict, which
+# copies faster than the mapping proxy.
+BASE_SNAPSHOT = (dict(BASE_TABLE), {}, {}, 16)  # 0-15 have preset values
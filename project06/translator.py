@@ -1,3 +1,78 @@
+from itertools import permutations
+
+# Precomputed encodings of every legal mnemonic, as integer bitfields.
+# A C instruction is 111a cccc ccdd djjj:
+#   C_PREFIX | COMP_TABLE[comp] | DEST_TABLE[dest] | JUMP_TABLE[jump]
+C_PREFIX = 0b111 << 13
+
+_COMP_BITS = {
+    '0': 0b101010,
+    '1': 0b111111,
+    '-1': 0b111010,
+    'D': 0b001100,
+    'A': 0b110000,
+    '!D': 0b001101,
+    '!A': 0b110001,
+    '-D': 0b001111,
+    '-A': 0b110011,
+    'D+1': 0b011111,
+    'A+1': 0b110111,
+    'D-1': 0b001110,
+    'A-1': 0b110010,
+    'D+A': 0b000010,
+    'D-A': 0b010011,
+    'A-D': 0b000111,
+    'D&A': 0b000000,
+    'D|A': 0b010101,
+    'A+D': 0b000010,
+    'A&D': 0b000000,
+    'A|D': 0b010101,
+}
+
+# comp bits including the a-bit, with M variants of every A mnemonic
+COMP_TABLE = {}
+for _mnemonic, _bits in _COMP_BITS.items():
+    COMP_TABLE[_mnemonic] = _bits << 6
+    if 'A' in _mnemonic:
+        COMP_TABLE[_mnemonic.replace('A', 'M')] = (0b1000000 | _bits) << 6
+
+# every ordering of every subset of A, D, M, e.g. MD and DM
+DEST_TABLE = {'': 0}
+for _size in range(1, 4):
+    for _registers in permutations('ADM', _size):
+        DEST_TABLE[''.join(_registers)] = (
+            ('A' in _registers) << 5
+            | ('D' in _registers) << 4
+            | ('M' in _registers) << 3)
+
+JUMP_TABLE = {
+    '': 0,
+    'JGT': 0b001,
+    'JEQ': 0b010,
+    'JGE': 0b011,
+    'JLT': 0b100,
+    'JNE': 0b101,
+    'JLE': 0b110,
+    'JMP': 0b111,
+}
+
+
+def encode_c_instruction(line: str) -> int:
+    # Encodes a C command dest=comp;jump into a 16-bit instruction
+    dest, jump = '', ''
+    comp = line
+    if '=' in comp:
+        dest, comp = comp.split('=', 1)
+    if ';' in comp:
+        comp, jump = comp.split(';', 1)
+
+    try:
+        return (C_PREFIX | COMP_TABLE[comp] | DEST_TABLE[dest]
+                | JUMP_TABLE[jump])
+    except KeyError:
+        raise ValueError(f'{line} is an invalid instruction.') from None
+
+
 # Translates Hack assembly language mnemonics into binary code
 class Translator:
     # Returns 3-bit binary code of dest mnemonic
@@ -14,36 +89,13 @@ class Translator:
 
         return ''.join(ddd)
 
+    # Returns the a-bit and 6 c-bits of comp mnemonic, from the same
+    # table as encode_c_instruction (commuted forms like M+D included)
     def translate_comp(self, mnemonic: str) -> str:
-        comp_dict = {
-            '0': '101010',
-            '1': '111111',
-            '-1': '111010',
-            'D': '001100',
-            'A': '110000',
-            '!D': '001101',
-            '!A': '110001',
-            '-D': '001111',
-            '-A': '110011',
-            'D+1': '011111',
-            'A+1': '110111',
-            'D-1': '001110',
-            'A-1': '110010',
-            'D+A': '000010',
-            'D-A': '010011',
-            'A-D': '000111',
-            'D&A': '000000',
-            'D|A': '010101',
-        }
-
-        a_bit = '0'
-        if 'M' in mnemonic:
-            a_bit = '1'
-            mnemonic = mnemonic.replace('M', 'A')
-
-        c_bit = comp_dict.get(mnemonic, '000000')
-
-        return a_bit + c_bit
+        bits = COMP_TABLE.get(mnemonic)
+        if bits is None:
+            raise ValueError(f'{mnemonic} is an invalid comp mnemonic.')
+        return format(bits >> 6, '07b')
 
     def translate_jump(self, mnemonic: str) -> str:
         jump_dict = {
@@ -1,5 +1,9 @@
 # writer.py
 # Writes to a file
+import sys
+from array import array
+from functools import partial
+
 
 class Writer:
     # Creates or overwrites (cleans) output file.
@@ -16,3 +20,58 @@ class Writer:
     def __del__(self):
         self.file.close()
         print("Closed file:", self.path)
+
+
+# Packed output formats. Each writes all words with a single write.
+# FORMATS maps a format name to (file extension, writer function).
+
+def write_binary(path: str, words, byteorder: str) -> None:
+    # Raw 16-bit words in the given byte order ('little' or 'big')
+    packed = array('H', words)
+    if byteorder != sys.byteorder:
+        packed.byteswap()
+    with open(path, 'wb') as f:
+        f.write(packed.tobytes())
+
+
+def write_intel_hex(path: str, words) -> None:
+    # Intel HEX, 16 data bytes per record, words stored big-endian.
+    # Byte address = 2 * ROM address.
+    packed = array('H', words)
+    if sys.byteorder != 'big':
+        packed.byteswap()
+    data = packed.tobytes()
+
+    records = []
+    for offset in range(0, len(data), 16):
+        if offset % 0x10000 == 0 and offset > 0:
+            # extended linear address record for the upper 16 bits
+            upper = (offset >> 16).to_bytes(2, 'big')
+            records.append(hex_record(0, 0x04, upper))
+        records.append(hex_record(offset & 0xFFFF, 0x00,
+                                  data[offset:offset + 16]))
+    records.append(hex_record(0, 0x01, b''))  # end of file
+
+    with open(path, 'w') as f:
+        f.write(''.join(records))
+
+
+def hex_record(address: int, record_type: int, data: bytes) -> str:
+    record = bytes([len(data), address >> 8, address & 0xFF,
+                    record_type]) + data
+    checksum = -sum(record) & 0xFF
+    return f':{record.hex().upper()}{checksum:02X}\n'
+
+
+def write_hack(path: str, words) -> None:
+    # Textual .hack format, one 16-character binary word per line
+    with open(path, 'w') as f:
+        f.write(''.join(f'{word:016b}\n' for word in words))
+
+
+FORMATS = {
+    'hack': ('.hack', write_hack),
+    'bin-le': ('.bin', partial(write_binary, byteorder='little')),
+    'bin-be': ('.bin', partial(write_binary, byteorder='big')),
+    'ihex': ('.hex', write_intel_hex),
+}
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+
+class TranslationCache:
+    """
+    On-disk cache of translated .vm files.
+
+    Each entry holds the assembly fragment of one .vm file, the shared
+    routines it uses, its source map entries and its instruction
+    selection counts. Entries are keyed by a
+    hash of the file's name, its content, the code generation mode, the
+    functions emitted and the translator version, so a stale entry is
+    never reused.
+
+    evict() removes entries older than max_age seconds, then removes
+    the least recently used entries until the cache fits in max_size
+    bytes.
+    """
+
+    SOURCES = ['Parser.py', 'CodeWriter.py', 'VMTranslator.py',
+               'CallGraph.py', 'Selector.py', 'Cache.py']
+
+    def __init__(self, directory, max_size: int = 64 * 1024 * 1024,
+                 max_age: float = 30 * 24 * 60 * 60) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.max_age = max_age
+        self.version = self.translator_version()
+        self.hits = 0
+        self.misses = 0
+
+    def translator_version(self) -> str:
+        # hash of the translator sources, changes with any code change
+        digest = hashlib.sha256()
+        for source in self.SOURCES:
+            digest.update((Path(__file__).parent / source).read_bytes())
+        return digest.hexdigest()
+
+    def key(self, vm_file, compact: bool, functions: list = None,
+            cache_top: bool = False, inline: str = '',
+            select: bool = False) -> str:
+        # functions lists the functions of the file that are emitted,
+        # None for all of them, inline describes the inlined functions
+        digest = hashlib.sha256()
+        digest.update(self.version.encode())
+        digest.update(f'{Path(vm_file).stem}:{compact}:{cache_top}:'
+                      f'{functions}:{inline}:{select}:'.encode())
+        digest.update(Path(vm_file).read_bytes())
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        # Returns the cached (lines, shared_routines, sources,
+        # selections) or None
+        entry = self.directory / key
+        try:
+            text = entry.read_text()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        os.utime(entry)  # mark as recently used
+        self.hits += 1
+        routines, sources, selections, *lines = text.split('\n')
+        return (lines, set(routines.split()),
+                [tuple(source) for source in json.loads(sources)],
+                json.loads(selections))
+
+    def put(self, key: str, lines: list, shared_routines: set,
+            sources: list, selections: dict) -> None:
+        entry = self.directory / key
+        temp = entry.with_suffix('.tmp')
+        temp.write_text('\n'.join([' '.join(sorted(shared_routines)),
+                                   json.dumps(sources),
+                                   json.dumps(selections)] + lines))
+        os.replace(temp, entry)  # readers never see a partial entry
+
+    def evict(self) -> None:
+        now = time.time()
+        entries = []
+        for entry in self.directory.iterdir():
+            stat = entry.stat()
+            if now - stat.st_mtime > self.max_age:
+                entry.unlink()
+            else:
+                entries.append((stat.st_mtime, stat.st_size, entry))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            entry.unlink()
+            total -= size
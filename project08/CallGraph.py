@@ -0,0 +1,185 @@
+from pathlib import Path
+import Parser
+
+
+class InlineFunction:
+    """
+    A function whose body can be copied into its call sites.
+
+    file_name is the stem of its .vm file (for static), depths the
+    stack depth above the frame before every command of commands and
+    saves the pointer registers (THIS, THAT) that the body changes and
+    that have to be restored afterwards, as return would.
+    """
+
+    __slots__ = ('name', 'file_name', 'num_locals', 'commands', 'depths',
+                 'saves')
+
+    def __init__(self, name: str, file_name: str, num_locals: int,
+                 commands: list, depths: list, saves: tuple) -> None:
+        self.name = name
+        self.file_name = file_name
+        self.num_locals = num_locals
+        self.commands = commands
+        self.depths = depths
+        self.saves = saves
+
+
+class CallGraph:
+    """
+    Call graph of a whole VM program.
+
+    Every .vm file is parsed once with Parser. calls maps each function
+    to the functions it calls and files maps it to the .vm file that
+    defines it. Commands before the first function of a file are kept
+    under None and treated as reachable.
+
+    reachable() returns the functions that can run when the program
+    starts at Sys.init, so that the translator can leave out the rest
+    (typically unused Jack OS routines).
+
+    bodies keeps the number of locals and the commands of every
+    function. inlinable() picks the small, non-recursive ones whose
+    stack depth is known at every command, so that their arguments and
+    locals can be addressed relative to SP at a call site.
+    """
+
+    ROOT = 'Sys.init'
+
+    def __init__(self, vm_files) -> None:
+        self.calls = {}  # function -> set of called functions
+        self.files = {}  # function -> .vm file defining it
+        self.bodies = {}  # function -> (number of locals, commands)
+        for vm_file in vm_files:
+            self.add_file(vm_file)
+
+    def add_file(self, vm_file) -> None:
+        parser = Parser.Parser(vm_file)
+        function = None
+        body = []
+        while parser.has_more_commands():
+            parser.advance()
+            command_type = parser.command_type()
+            if command_type == 'C_FUNCTION':
+                function = parser.arg1()
+                self.calls.setdefault(function, set())
+                self.files[function] = vm_file
+                body = []
+                self.bodies[function] = (parser.arg2(), body)
+                continue
+            elif command_type == 'C_CALL':
+                self.calls.setdefault(function, set()).add(parser.arg1())
+            body.append(parser.current)
+
+    def reachable(self, root: str = ROOT, inlined=()) -> set:
+        # The functions in inlined are not called, their bodies are
+        # copied into the callers. They are only live as root or when
+        # called from an inlined body, as those calls are not inlined.
+        if root not in self.calls:
+            raise ValueError(f'{root} is not defined, cannot tell which '
+                             f'functions are used.')
+
+        seen = set()
+        pending = [root] + list(self.calls.get(None, ()))
+        while pending:
+            function = pending.pop()
+            if function in seen or function not in self.calls:
+                continue  # seen, or not defined in the program
+            seen.add(function)
+            pending.extend(self.calls[function])
+        called = set()  # by inlined bodies
+        for function in seen & set(inlined):
+            called |= self.calls[function]
+        return {function for function in seen
+                if function == root or function not in inlined
+                or function in called}
+
+    def is_recursive(self, function: str) -> bool:
+        # True if function can call itself, directly or not
+        seen = set()
+        pending = list(self.calls.get(function, ()))
+        while pending:
+            callee = pending.pop()
+            if callee == function:
+                return True
+            if callee not in seen:
+                seen.add(callee)
+                pending.extend(self.calls.get(callee, ()))
+        return False
+
+    def inlinable(self, max_size: int) -> dict:
+        # function -> InlineFunction for the called functions of at most
+        # max_size commands that can be inlined
+        called = set().union(*self.calls.values())
+        functions = {}
+        for function, (num_locals, commands) in self.bodies.items():
+            if (function not in called or len(commands) > max_size
+                    or self.is_recursive(function)):
+                continue
+            depths = stack_depths(commands)
+            if depths is None:
+                continue
+            saves = tuple(register for register, index
+                          in [('THIS', 0), ('THAT', 1)]
+                          if any(command.type == 'C_POP'
+                                 and command.args == ('pointer', index)
+                                 for command in commands))
+            functions[function] = InlineFunction(
+                function, Path(self.files[function]).stem, num_locals,
+                commands, depths, saves)
+        return functions
+
+    def functions_in(self, vm_file, functions: set) -> list:
+        # the functions of the set defined in vm_file, sorted
+        vm_file = Path(vm_file)
+        return sorted(function for function in functions
+                      if Path(self.files[function]) == vm_file)
+
+
+def stack_depths(commands: list):
+    # Returns the stack depth before every command of a function body,
+    # counted from the function's frame, or None if it differs between
+    # the paths reaching a command, drops below the frame, or the body
+    # can run past its last command
+    labels = {}  # label -> depth where it is defined or jumped to
+    depths = []
+    depth = 0
+    for command in commands:
+        kind = command.type
+        if kind == 'C_LABEL':
+            known = labels.get(command.args[0])
+            if depth is None:
+                depth = known
+            elif known is not None and known != depth:
+                return None
+            labels[command.args[0]] = depth
+        if depth is None or kind in [None, 'C_FUNCTION']:
+            return None  # unknown depth or command
+        depths.append(depth)
+
+        if kind == 'C_PUSH':
+            depth += 1
+        elif kind in ['C_POP', 'C_IF']:
+            depth -= 1
+        elif kind == 'C_ARITHMETIC' and command.args[0] not in ['neg', 'not']:
+            depth -= 1
+        elif kind == 'C_CALL':
+            depth += 1 - command.args[1]
+        if depth < 0:
+            return None
+
+        if kind in ['C_IF', 'C_GOTO']:
+            if labels.setdefault(command.args[0], depth) != depth:
+                return None
+        if kind == 'C_RETURN':
+            if depth < 1:
+                return None
+            depth = None
+        elif kind == 'C_GOTO':
+            depth = None
+
+    defined = {command.args[0] for command in commands
+               if command.type == 'C_LABEL'}
+    if depth is not None or not defined.issuperset(labels):
+        return None
+    return depths
@@ -1,13 +1,74 @@
+import re
 from pathlib import Path
 from typing import List
+from Optimizer import PeepholeOptimizer
+
+# return labels of write_call and the labels of inline eq/gt/lt
+GENERATED_LABEL = re.compile(r'\$Ret\.\d+$|\.(END)?(EQ|GT|LT)\.\d+$')
 
 
 class CodeWriter:
-    def __init__(self, asm_file, vm_file) -> None:
-        self.in_file = vm_file
-        self.in_file_name = Path(vm_file).stem
+    """
+    Translates VM commands into Hack assembly code.
+
+    Emitted lines are buffered in memory and written to the output
+    .asm file in a single pass by close(). A CodeWriter can be used as
+    a context manager, in which case close() is called on exit.
+
+    If optimize is set, the buffered instruction stream is passed
+    through a PeepholeOptimizer before it is written.
+
+    If compact is set, eq/gt/lt, call and return jump to shared
+    $$EQ/$$GT/$$LT/$$CALL/$$RETURN routines instead of being inlined
+    at every use site. Each routine used is emitted once, at the end
+    of the program.
+
+    If cache_top is set, the top of the stack is kept in D across
+    straight-line VM code instead of being stored and reloaded by every
+    command. top_in_d tells whether it currently is; the stack in RAM
+    then holds everything below it. The value is written back (flushed)
+    before labels, jumps, calls, function entries and returns, so the
+    stack is always in RAM where control flow meets.
+
+    If short_labels is set, finish() renames the generated return and
+    comparison labels to $0, $1, ... in order of first use.
+    label_names maps the short names back to the readable ones.
+
+    Between begin_inline() and end_inline() the commands written are the
+    body of an InlineFunction (see CallGraph) copied to a call site.
+    The caller's arguments stay on the stack, with the callee's locals
+    and saved THIS/THAT pushed above them, and argument and local are
+    addressed relative to SP: inline_depth is the stack depth above this
+    frame before the current command.
+
+    sources records where the code of every VM command starts, as
+    (index in lines, .vm file name, line in the .vm file, function)
+    tuples, for source maps. Shared routines have no .vm file and are
+    named as the function.
+    """
+
+    SHARED_ROUTINES = ['$$EQ', '$$GT', '$$LT', '$$CALL', '$$RETURN']
+
+    def __init__(self, asm_file, vm_file=None, optimize=False,
+                 compact=False, cache_top=False, short_labels=False) -> None:
+        self.in_file = None
+        self.in_file_name = None
         self.out_file = asm_file
         self.out_file_name = Path(asm_file).stem
+        self.lines = []  # buffered assembly output
+        self.closed = False
+        self.finished = False
+        self.compact = compact
+        self.cache_top = cache_top
+        self.top_in_d = False  # top of the stack is in D, not in RAM
+        self.short_labels = short_labels
+        self.label_names = {}  # short label -> generated label
+        self.inline = None  # (function, num_args, label prefix, file)
+        self.inline_depth = 0
+        self.inline_count = 0
+        self.shared_routines = set()  # routines used in compact mode
+        self.sources = []
+        self.optimizer = PeepholeOptimizer() if optimize else None
 
         # counters for Boolean comparisons
         self.eq_count = 0
@@ -16,12 +77,42 @@ class CodeWriter:
 
         self.call_count = 0
         self.function_name = None  # for function labels
+        self.label_scope = ''  # prefix of generated labels
+
+        if vm_file is not None:
+            self.set_file_name(vm_file)
 
         self.addresses = self.address_dict()
 
+    def __enter__(self) -> 'CodeWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def set_file_name(self, vm_file) -> None:
+        # informs the writer that translation of a new .vm file started
+        self.in_file = vm_file
+        self.in_file_name = Path(vm_file).stem
+
+        # generated labels are unique per file, so files can be
+        # translated independently of each other
+        self.label_scope = f'{self.in_file_name}.'
+        self.eq_count = 0
+        self.gt_count = 0
+        self.lt_count = 0
+        self.call_count = 0
+        self.inline_count = 0
+
     # load M[address] to D
     def write_push(self, segment: str, index: str) -> None:
         self.write_line(f'// push {segment} {index}')
+        if self.inline is not None and segment in ['argument', 'local']:
+            self.write_push_frame(segment, index)
+            return
+        if self.cache_top:
+            self.write_push_cached(segment, index)
+            return
         self.resolve_address(segment, index)
         if segment == 'constant':  # check
             self.write_line('D=A')
@@ -32,6 +123,12 @@ class CodeWriter:
     # load D to M[address]
     def write_pop(self, segment: str, index: str) -> None:
         self.write_line(f'// pop {segment} {index}')
+        if self.inline is not None and segment in ['argument', 'local']:
+            self.write_pop_frame(segment, index)
+            return
+        if self.cache_top:
+            self.write_pop_cached(segment, index)
+            return
         self.resolve_address(segment, index)
         self.write_lines(
             [
@@ -69,9 +166,199 @@ class CodeWriter:
         else:
             self.raise_unknown_error(segment)
 
+    def direct_address(self, segment: str, index: int):
+        # the A instruction of segments at a fixed address, else None
+        if segment == 'constant':
+            return f'@{index}'
+        elif segment == 'static':
+            return f'@{self.in_file_name}.{index}'
+        elif segment in ['pointer', 'temp']:
+            return f'@R{self.addresses[segment] + index}'
+        elif segment in ['local', 'argument', 'this', 'that']:
+            return None
+        self.raise_unknown_error(segment)
+
+    def write_push_cached(self, segment: str, index: int) -> None:
+        # the pushed value becomes the new top in D
+        self.flush_stack_top()
+        self.load_segment_to_d(segment, index)
+        self.top_in_d = True
+
+    def write_pop_cached(self, segment: str, index: int) -> None:
+        self.load_stack_top()
+        self.store_d_to_segment(segment, index)
+        self.top_in_d = False
+
+    def load_segment_to_d(self, segment: str, index: int) -> None:
+        # D = the value push segment index would push, with the
+        # shortest code for the segment and index
+        address = self.direct_address(segment, index)
+        if segment == 'constant':
+            if index in [0, 1]:
+                self.write_line(f'D={index}')
+            else:
+                self.write_lines([address, 'D=A'])
+        elif address is not None:
+            self.write_lines([address, 'D=M'])
+        elif index <= 1:
+            self.write_lines([f'@{self.addresses[segment]}', 'A=M']
+                             + ['A=A+1'] * index + ['D=M'])
+        else:
+            self.write_lines([f'@{self.addresses[segment]}', 'D=M',
+                              f'@{index}', 'A=D+A', 'D=M'])
+
+    def store_d_to_segment(self, segment: str, index: int) -> None:
+        # segment index = D, as pop would store it
+        address = self.direct_address(segment, index)
+        if address is not None:
+            self.write_lines([address, 'M=D'])
+        elif index <= 6:
+            self.write_lines([f'@{self.addresses[segment]}', 'A=M']
+                             + ['A=A+1'] * index + ['M=D'])
+        else:
+            # D = value + address, so that both can be recovered from
+            # D and the value saved in R13
+            self.write_lines(
+                [
+                    '@R13',
+                    'M=D',
+                    f'@{self.addresses[segment]}',
+                    'D=D+M',
+                    f'@{index}',
+                    'D=D+A',
+                    '@R13',
+                    'A=D-M',  # address
+                    'D=D-A',  # value
+                    'M=D'
+                ]
+            )
+
+    def begin_inline(self, function, num_args: int) -> None:
+        # Starts the body of function (an InlineFunction) in place of a
+        # call with num_args arguments
+        self.write_line(f'// inline {function.name} {num_args}')
+        self.flush_stack_top()
+        for _ in range(function.num_locals):
+            self.write_lines(['@SP', 'AM=M+1', 'A=A-1', 'M=0'])
+        for register in function.saves:
+            self.write_lines([f'@{register}', 'D=M', '@SP', 'AM=M+1',
+                              'A=A-1', 'M=D'])
+
+        prefix = f'{self.label_scope}INLINE.{self.inline_count}'
+        self.inline = (function, num_args, prefix, self.in_file_name)
+        self.inline_count += 1
+        self.in_file_name = function.file_name  # for static
+
+    def end_inline(self) -> None:
+        # The result is on the stack (in D with cache_top) where the
+        # first argument was
+        function, num_args, prefix, file_name = self.inline
+        end = f'{prefix}.END'
+        if self.lines[-2:] == [f'@{end}', '0;JMP']:
+            del self.lines[-2:]  # return as the last command
+        self.write_line(f'({end})')
+        self.in_file_name = file_name
+        self.inline = None
+        self.top_in_d = self.cache_top
+
+    def frame_offset(self, segment: str, index: int, depth: int) -> int:
+        # distance below SP of argument/local index of an inlined body,
+        # with depth values on the stack above the frame
+        function, num_args = self.inline[:2]
+        offset = depth + len(function.saves) + function.num_locals - index
+        if segment == 'argument':
+            offset += num_args
+        return offset
+
+    def load_below_sp(self, offset: int) -> None:
+        # D = RAM[SP - offset]
+        if offset <= 3:
+            self.write_lines(['@SP', 'A=M-1'] + ['A=A-1'] * (offset - 1)
+                             + ['D=M'])
+        else:
+            self.write_lines([f'@{offset}', 'D=A', '@SP', 'A=M-D', 'D=M'])
+
+    def write_push_frame(self, segment: str, index: int) -> None:
+        self.flush_stack_top()
+        self.load_below_sp(
+            self.frame_offset(segment, index, self.inline_depth))
+        if self.cache_top:
+            self.top_in_d = True
+        else:
+            self.push_D_to_stack()
+
+    def write_pop_frame(self, segment: str, index: int) -> None:
+        if self.cache_top:
+            self.load_stack_top()
+        else:
+            self.write_lines(['@SP', 'AM=M-1', 'D=M'])
+        self.top_in_d = False
+
+        # RAM[SP - offset] = D, SP is below the popped value now
+        offset = self.frame_offset(segment, index, self.inline_depth - 1)
+        if offset <= 7:
+            self.write_lines(['@SP', 'A=M-1'] + ['A=A-1'] * (offset - 1)
+                             + ['M=D'])
+        else:
+            self.write_lines(
+                [
+                    '@R13',
+                    'M=D',
+                    '@SP',
+                    'D=D+M',
+                    f'@{offset}',
+                    'D=D-A',  # value + address
+                    '@R13',
+                    'A=D-M',  # address
+                    'D=D-A',  # value
+                    'M=D'
+                ]
+            )
+
+    def write_inline_return(self) -> None:
+        # Restores the saved pointers, replaces the frame by the return
+        # value and jumps to the end of the inlined body
+        function, num_args, prefix, _ = self.inline
+        if self.cache_top:
+            self.load_stack_top()
+        else:
+            self.write_lines(['@SP', 'AM=M-1', 'D=M'])
+        depth = self.inline_depth - 1  # values left above the frame
+
+        saves = function.saves
+        if saves:
+            self.write_lines(['@R13', 'M=D'])
+            for slot, register in enumerate(saves):
+                self.load_below_sp(depth + len(saves) - slot)
+                self.write_lines([f'@{register}', 'M=D'])
+            self.write_lines(['@R13', 'D=M'])
+
+        # SP = address of the first argument
+        drop = depth + len(saves) + function.num_locals + num_args
+        if drop <= 5:
+            if drop:
+                self.write_lines(['@SP'] + ['M=M-1'] * drop)
+        else:
+            self.write_lines(['@R13', 'M=D', f'@{drop}', 'D=A', '@SP',
+                              'M=M-D', '@R13', 'D=M'])
+
+        if not self.cache_top:  # else the value stays in D
+            self.write_lines(['@SP', 'AM=M+1', 'A=A-1', 'M=D'])
+        self.write_lines([f'@{prefix}.END', '0;JMP'])
+        self.top_in_d = False  # nothing reaches the next command
+
     def write_arithmetic(self, operation: str) -> None:
         self.write_line(f'// {operation}')
 
+        if self.compact and operation in ['eq', 'gt', 'lt']:
+            self.flush_stack_top()
+            self.write_compare_call(operation)
+            return
+
+        if self.cache_top:
+            self.write_arithmetic_cached(operation)
+            return
+
         if operation not in ['neg', 'not']:  # binary operators
             self.pop_stack_to_D()
         self.decrement_sp()
@@ -100,11 +387,58 @@ class CodeWriter:
 
         self.increment_sp()
 
+    def write_arithmetic_cached(self, operation: str) -> None:
+        # y (or the only operand) is taken from D, x popped from RAM,
+        # and the result left in D
+        self.load_stack_top()
+        if operation == 'neg':
+            self.write_line('D=-D')
+        elif operation == 'not':
+            self.write_line('D=!D')
+        else:
+            self.write_lines(['@SP', 'AM=M-1'])
+            if operation == 'add':
+                self.write_line('D=D+M')
+            elif operation == 'sub':
+                self.write_line('D=M-D')
+            elif operation == 'and':
+                self.write_line('D=D&M')
+            elif operation == 'or':
+                self.write_line('D=D|M')
+            elif operation == 'eq':
+                self.write_compare_to_d('EQ', 'JEQ', self.eq_count)
+                self.eq_count += 1
+            elif operation == 'gt':
+                self.write_compare_to_d('GT', 'JGT', self.gt_count)
+                self.gt_count += 1
+            elif operation == 'lt':
+                self.write_compare_to_d('LT', 'JLT', self.lt_count)
+                self.lt_count += 1
+            else:
+                self.raise_unknown_error(operation)
+        self.top_in_d = True
+
+    def write_compare_to_d(self, name: str, jump: str, count: int) -> None:
+        # D = x <jump> y, for x in M and y in D
+        self.write_lines(
+            [
+                'D=M-D',
+                f'@{self.label_scope}{name}.{count}',
+                f'D;{jump}',
+                'D=0',  # False
+                f'@{self.label_scope}END{name}.{count}',
+                '0;JMP',
+                f'({self.label_scope}{name}.{count})',
+                'D=-1',  # True
+                f'({self.label_scope}END{name}.{count})'
+            ]
+        )
+
     def write_eq(self) -> None:
         self.write_lines(
             [
                 'D=M-D',
-                f'@EQ.{self.eq_count}',
+                f'@{self.label_scope}EQ.{self.eq_count}',
                 'D;JEQ'
             ]
         )
@@ -112,16 +446,16 @@ class CodeWriter:
         self.write_lines(
             [
                 'M=0',  # False
-                f'@ENDEQ.{self.eq_count}',
+                f'@{self.label_scope}ENDEQ.{self.eq_count}',
                 '0;JMP',
-                f'(EQ.{self.eq_count})'
+                f'({self.label_scope}EQ.{self.eq_count})'
             ]
         )
         self.set_A_to_sp()
         self.write_lines(
             [
                 'M=-1',  # True
-                f'(ENDEQ.{self.eq_count})'
+                f'({self.label_scope}ENDEQ.{self.eq_count})'
             ]
         )
         self.eq_count += 1
@@ -130,7 +464,7 @@ class CodeWriter:
         self.write_lines(
             [
                 'D=M-D',
-                f'@GT.{self.gt_count}',
+                f'@{self.label_scope}GT.{self.gt_count}',
                 'D;JGT'
             ]
         )
@@ -138,16 +472,16 @@ class CodeWriter:
         self.write_lines(
             [
                 'M=0',  # False
-                f'@ENDGT.{self.gt_count}',
+                f'@{self.label_scope}ENDGT.{self.gt_count}',
                 '0;JMP',
-                f'(GT.{self.gt_count})'
+                f'({self.label_scope}GT.{self.gt_count})'
             ]
         )
         self.set_A_to_sp()
         self.write_lines(
             [
                 'M=-1',  # True
-                f'(ENDGT.{self.gt_count})'
+                f'({self.label_scope}ENDGT.{self.gt_count})'
             ]
         )
         self.gt_count += 1
@@ -156,7 +490,7 @@ class CodeWriter:
         self.write_lines(
             [
                 'D=M-D',
-                f'@LT.{self.lt_count}',
+                f'@{self.label_scope}LT.{self.lt_count}',
                 'D;JLT'
             ]
         )
@@ -164,22 +498,74 @@ class CodeWriter:
         self.write_lines(
             [
                 'M=0',  # False
-                f'@ENDLT.{self.lt_count}',
+                f'@{self.label_scope}ENDLT.{self.lt_count}',
                 '0;JMP',
-                f'(LT.{self.lt_count})'
+                f'({self.label_scope}LT.{self.lt_count})'
             ]
         )
         self.set_A_to_sp()
         self.write_lines(
             [
                 'M=-1',  # True
-                f'(ENDLT.{self.lt_count})'
+                f'({self.label_scope}ENDLT.{self.lt_count})'
             ]
         )
         self.lt_count += 1
 
+    def write_compare_call(self, operation: str) -> None:
+        # D = return address, then jump to the shared comparison routine
+        if operation == 'eq':
+            count = self.eq_count
+            self.eq_count += 1
+        elif operation == 'gt':
+            count = self.gt_count
+            self.gt_count += 1
+        else:
+            count = self.lt_count
+            self.lt_count += 1
+
+        name = operation.upper()
+        self.write_lines(
+            [
+                f'@{self.label_scope}{name}.{count}',
+                'D=A',
+                f'@$${name}',
+                '0;JMP',
+                f'({self.label_scope}{name}.{count})'
+            ]
+        )
+        self.shared_routines.add(f'$${name}')
+
+    def write_compare_routine(self, name: str, jump: str) -> None:
+        # Pops y and x, replaces them with x <jump> y, returns to D
+        self.write_lines(
+            [
+                f'({name})',
+                '@R13',
+                'M=D',  # save return address
+                '@SP',
+                'AM=M-1',
+                'D=M',
+                'A=A-1',
+                'D=M-D',
+                'M=-1',  # True
+                f'@{name}.TRUE',
+                f'D;{jump}',
+                '@SP',
+                'A=M-1',
+                'M=0',  # False
+                f'({name}.TRUE)',
+                '@R13',
+                'A=M',
+                '0;JMP'
+            ]
+        )
+
     def create_label(self, label: str, function_type: str = None) -> str:
-        asm_label = f'{self.in_file_name}${label}'
+        if self.inline is not None:
+            asm_label = f'{self.inline[2]}${label}'
+        else:
+            asm_label = f'{self.in_file_name}${label}'
         if function_type in ['if', 'goto']:
             return f'@{asm_label}'
         else:
@@ -187,10 +573,12 @@ class CodeWriter:
 
     def write_label(self, label: str) -> None:
         self.write_line(f'// label {label}')
+        self.flush_stack_top()
         self.write_line(f'{self.create_label(label)}')
 
     def write_goto(self, label: str) -> None:  # check
         self.write_line(f'// goto {label}')
+        self.flush_stack_top()
         self.write_lines(
             [
                 f"{self.create_label(label, 'goto')}",
@@ -200,7 +588,11 @@ class CodeWriter:
 
     def write_if(self, label: str) -> None:  # check
         self.write_line(f'// if-goto {label}')
-        self.pop_stack_to_D()
+        if self.cache_top:
+            self.load_stack_top()
+            self.top_in_d = False
+        else:
+            self.pop_stack_to_D()
         self.write_lines(
             [
                 f"{self.create_label(label, 'if')}",
@@ -210,6 +602,7 @@ class CodeWriter:
 
     def write_function(self, function_name: str, num_locals: int) -> None:  # check
         self.write_line(f'// function {function_name} {num_locals}')
+        self.flush_stack_top()
         self.write_line(f'({function_name})')
 
         for i in range(num_locals):  # push constant 0 i times
@@ -219,11 +612,27 @@ class CodeWriter:
         self.function_name = function_name
 
     def write_return(self) -> None:  # debug if needed
+        self.write_line(f'// return')
+        if self.inline is not None:
+            self.write_inline_return()
+            return
+        self.flush_stack_top()
+
+        if self.compact:
+            self.write_lines(
+                [
+                    '@$$RETURN',
+                    '0;JMP'
+                ]
+            )
+            self.shared_routines.add('$$RETURN')
+        else:
+            self.write_return_body()
+
+    def write_return_body(self) -> None:
         FRAME = 'R13'
         RET_ADDR = 'R14'
 
-        self.write_line(f'// return')
-
         # FRAME = LCL
         self.write_lines(
             [
@@ -299,9 +708,33 @@ class CodeWriter:
 
     def write_call(self, function_name: str, num_args: int) -> None:  # check
         # unique return label
-        RET_ADDR = f'{function_name}$Ret.{self.call_count}'
+        RET_ADDR = (f'{self.label_scope}{function_name}'
+                    f'$Ret.{self.call_count}')
 
         self.write_line(f'// call {function_name} {num_args}')
+        self.flush_stack_top()
+
+        if self.compact:
+            self.write_lines(
+                [
+                    f'@{str(num_args)}',
+                    'D=A',
+                    '@R13',  # R13 = nArgs
+                    'M=D',
+                    f'@{function_name}',
+                    'D=A',
+                    '@R14',  # R14 = f
+                    'M=D',
+                    f'@{RET_ADDR}',
+                    'D=A',
+                    '@$$CALL',
+                    '0;JMP',
+                    f'({RET_ADDR})'
+                ]
+            )
+            self.shared_routines.add('$$CALL')
+            self.call_count += 1
+            return
 
         # push return address
         self.write_lines(
@@ -356,6 +789,85 @@ class CodeWriter:
 
         self.call_count += 1
 
+    def write_call_routine(self) -> None:
+        # D = return address, R13 = nArgs, R14 = f
+        self.write_line('($$CALL)')
+        self.push_D_to_stack()
+
+        # push LCL, ARG, THIS, THAT
+        for address in ['@LCL', '@ARG', '@THIS', '@THAT']:
+            self.write_lines(
+                [
+                    f'{address}',
+                    'D=M'
+                ]
+            )
+            self.push_D_to_stack()
+
+        # ARG = SP - 5 - nArgs
+        self.write_lines(
+            [
+                '@R13',
+                'D=M',
+                '@5',
+                'D=D+A',
+                '@SP',
+                'D=M-D',
+                '@ARG',
+                'M=D'
+            ]
+        )
+
+        # LCL = SP
+        self.write_lines(
+            [
+                '@SP',
+                'D=M',
+                '@LCL',
+                'M=D'
+            ]
+        )
+
+        # goto f
+        self.write_lines(
+            [
+                '@R14',
+                'A=M',
+                '0;JMP'
+            ]
+        )
+
+    def write_shared_routines(self) -> None:
+        if not self.shared_routines:
+            return
+
+        # keep execution from falling through into the routines
+        self.write_lines(
+            [
+                '// shared routines',
+                '($$HALT)',
+                '@$$HALT',
+                '0;JMP'
+            ]
+        )
+
+        for routine in self.SHARED_ROUTINES:
+            if routine not in self.shared_routines:
+                continue
+            self.write_line('')
+            self.sources.append((len(self.lines), None, 0, routine))
+            if routine == '$$EQ':
+                self.write_compare_routine(routine, 'JEQ')
+            elif routine == '$$GT':
+                self.write_compare_routine(routine, 'JGT')
+            elif routine == '$$LT':
+                self.write_compare_routine(routine, 'JLT')
+            elif routine == '$$CALL':
+                self.write_call_routine()
+            elif routine == '$$RETURN':
+                self.write_line('($$RETURN)')
+                self.write_return_body()
+
     def write_bootstrap(self) -> None:
         self.write_lines(
             [
@@ -378,14 +890,72 @@ class CodeWriter:
             'static': 16,  # base addresses 16 - 255
         }
 
+    def add_source(self, start: int, vm_line: int) -> None:
+        # the code of the command at vm_line of the current file
+        # starts at lines[start]
+        self.sources.append((start, Path(self.in_file).name, vm_line,
+                             self.function_name))
+
     def write_line(self, line: str) -> None:
-        with open(self.out_file, 'a') as f:
-            f.write(f'{line}\n')
+        self.lines.append(line)
 
     def write_lines(self, lines: List[str]) -> None:
-        with open(self.out_file, 'a') as f:
-            for line in lines:
-                f.write(f'{line}\n')
+        self.lines.extend(lines)
+
+    def finish(self) -> None:
+        # appends shared routines and runs the optimizer, once
+        if self.finished:
+            return
+        self.write_shared_routines()
+        if self.optimizer is not None:
+            self.lines = self.optimizer.optimize(self.lines)
+            positions = self.optimizer.positions
+            self.sources = [(positions[start], vm_file, vm_line, function)
+                            for start, vm_file, vm_line, function
+                            in self.sources]
+        if self.short_labels:
+            self.shorten_labels()
+        self.finished = True
+
+    def shorten_labels(self) -> None:
+        # Runs on the whole program, so that files translated separately
+        # (in parallel or from the cache) share one numbering
+        renames = {}  # label -> short label, or itself if not generated
+        lines = self.lines
+        for index, line in enumerate(lines):
+            if line[:1] == '@':
+                name = line[1:]
+            elif line[:1] == '(':
+                name = line[1:-1]
+            else:
+                continue
+
+            short = renames.get(name)
+            if short is None:
+                if GENERATED_LABEL.search(name):
+                    short = f'${len(self.label_names)}'
+                    self.label_names[short] = name
+                else:
+                    short = name
+                renames[name] = short
+            if short is not name:
+                lines[index] = (f'@{short}' if line[0] == '@'
+                                else f'({short})')
+
+    def instruction_count(self) -> int:
+        # number of ROM words taken by the buffered output
+        return sum(1 for line in self.lines
+                   if line and line[0] not in '/(')
+
+    def close(self) -> None:
+        # flush buffered output to the .asm file with a single write
+        if self.closed:
+            return
+        self.finish()
+        with open(self.out_file, 'w') as f:
+            if self.lines:
+                f.write('\n'.join(self.lines) + '\n')
+        self.closed = True
 
     def push_D_to_stack(self) -> None:
         # Push D value to top of stack, increment @SP
@@ -410,6 +980,31 @@ class CodeWriter:
         #     ]
         # )
 
+    def flush_stack_top(self) -> None:
+        # Writes a top of stack held in D back to the stack in RAM
+        if self.top_in_d:
+            self.write_lines(
+                [
+                    '@SP',
+                    'AM=M+1',
+                    'A=A-1',
+                    'M=D'
+                ]
+            )
+            self.top_in_d = False
+
+    def load_stack_top(self) -> None:
+        # Makes sure the top of stack is in D, popping it if needed
+        if not self.top_in_d:
+            self.write_lines(
+                [
+                    '@SP',
+                    'AM=M-1',
+                    'D=M'
+                ]
+            )
+            self.top_in_d = True
+
     def increment_sp(self) -> None:
         self.write_lines(['@SP',
                           'M=M+1'])
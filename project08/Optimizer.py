@@ -0,0 +1,140 @@
+import re
+from typing import List
+
+
+class PeepholeOptimizer:
+    """
+    Rewrites redundant instruction sequences in emitted Hack assembly.
+
+    Rules are (name, pattern, replacement) entries. A pattern is matched
+    against consecutive instructions, skipping comments and blank lines.
+    Labels are jump targets, so no pattern may match across one.
+    Pattern lines may contain {0}, which matches any operand and is
+    substituted into the replacement.
+
+    Every rule leaves A, D and memory in the same state as the code it
+    replaces, so rules can be applied anywhere and in any order.
+    """
+
+    RULES = [
+        # push_D_to_stack + pop_stack_to_D: SP is restored, D unchanged
+        ('inc-dec-sp',
+         ['@SP', 'M=M+1', '@SP', 'M=M-1'],
+         ['@SP']),
+        # decrement_sp + A=M
+        ('dec-sp-load',
+         ['@SP', 'M=M-1', 'A=M'],
+         ['@SP', 'AM=M-1']),
+        # decrement_sp + set_A_to_sp
+        ('dec-sp-set-a',
+         ['@SP', 'M=M-1', '@SP', 'A=M'],
+         ['@SP', 'AM=M-1']),
+        # repeated set_A_to_sp
+        ('set-a-twice',
+         ['@SP', 'A=M', '@SP', 'A=M'],
+         ['@SP', 'A=M']),
+        # storing D and reading it straight back
+        ('store-reload-stack',
+         ['@SP', 'A=M', 'M=D', '@SP', 'A=M', 'D=M'],
+         ['@SP', 'A=M', 'M=D']),
+        ('store-reload',
+         ['@{0}', 'M=D', '@{0}', 'D=M'],
+         ['@{0}', 'M=D']),
+        # frame offset loads in write_return
+        ('offset-load',
+         ['D=D-A', 'A=D', 'D=M'],
+         ['A=D-A', 'D=M']),
+    ]
+
+    def __init__(self) -> None:
+        # rules indexed by the last line of their pattern,
+        # which must be a literal instruction
+        self.rules = {}
+        for name, pattern, replacement in self.RULES:
+            self.rules.setdefault(pattern[-1], []).append(
+                (name, self.compile_pattern(pattern), replacement))
+        self.instructions_before = 0
+        self.instructions_after = 0
+        self.rule_counts = {name: 0 for name, _, _ in self.RULES}
+        self.positions = []
+
+    def compile_pattern(self, pattern: List[str]) -> list:
+        # literal lines stay strings, lines with an operand become regexes
+        return [re.compile(re.escape(line).replace(r'\{0\}', r'(.+)') + '$')
+                if '{0}' in line else line
+                for line in pattern]
+
+    def optimize(self, lines: List[str]) -> List[str]:
+        out = []
+        code = []  # indices in out of instructions since the last label
+        removed = 0
+
+        for line in lines:
+            out.append(line)
+            if line == '' or line[0] == '/':  # blank line or comment
+                continue
+            if line[0] == '(':
+                code = []
+                continue
+            self.instructions_before += 1
+            code.append(len(out) - 1)
+
+            if line in self.rules:
+                while True:
+                    saved = self.rewrite(out, code)
+                    if saved is None:
+                        break
+                    removed += saved
+
+        self.instructions_after = self.instructions_before - removed
+
+        # positions[i] = index in the result of input line i (or of the
+        # next kept line), so that line references can be updated
+        result = []
+        self.positions = []
+        for line in out:
+            self.positions.append(len(result))
+            if line is not None:
+                result.append(line)
+        return result
+
+    def rewrite(self, out: list, code: list):
+        # Applies the first rule matching the tail of code in place.
+        # Returns the number of instructions saved, or None if no match.
+        for name, pattern, replacement in self.rules.get(out[code[-1]], ()):
+            size = len(pattern)
+            if len(code) < size:
+                continue
+
+            positions = code[-size:]
+            operand = None
+            for position, expected in zip(positions, pattern):
+                line = out[position]
+                if isinstance(expected, str):
+                    if line != expected:
+                        break
+                    continue
+                match = expected.match(line)
+                if match is None:
+                    break
+                if operand is None:
+                    operand = match.group(1)
+                elif operand != match.group(1):
+                    break
+            else:
+                new_lines = [line.replace('{0}', operand or '')
+                             for line in replacement]
+                for position in positions:
+                    out[position] = None
+                for position, line in zip(positions, new_lines):
+                    out[position] = line
+                del code[-size:]
+                code.extend(positions[:len(new_lines)])
+                self.rule_counts[name] += 1
+                return size - len(new_lines)
+
+        return None
+
+    @property
+    def removed(self) -> int:
+        return self.instructions_before - self.instructions_after
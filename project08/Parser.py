@@ -1,7 +1,27 @@
-import re
 from pathlib import Path
 
 
+class Command:
+    """
+    One tokenized VM command: its name (push, add, ...), its type
+    (C_PUSH, C_ARITHMETIC, ...), its arguments and its line in the file.
+
+    args holds the arguments in the order the CodeWriter write_*
+    methods take them: the operation for arithmetic commands, the
+    segment and int index for push/pop, the name and int count for
+    function/call, the label for branching, nothing for return.
+    """
+
+    __slots__ = ('name', 'type', 'args', 'line_number')
+
+    def __init__(self, name: str, command_type: str, args: tuple,
+                 line_number: int) -> None:
+        self.name = name
+        self.type = command_type
+        self.args = args
+        self.line_number = line_number
+
+
 class Parser:
     """
     Parses a single .vm file and encapsulates access to input code.
@@ -14,41 +34,56 @@ class Parser:
 
     If command type is arithmetic, segment and index parts are excluded.
     e.g. add
+
+    Every line is split once, when the file is read, into a Command
+    in commands. Lines with an unknown command get type None.
     """
 
     def __init__(self, vm_file) -> None:
         self.in_file = vm_file
         self.in_file_name = Path(vm_file).stem
 
-        self.lines = self.remove_comments(self.remove_empty_strings(vm_file))
-        self.lines.reverse()
-        self.current_line = None
         self.command_types = self.command_types_dict()
+        self.commands = self.tokenize(vm_file)
+        self.next_command = 0
+        self.current = None
+        self.current_line_number = 0
 
-    def remove_comments(self, lines: list) -> list:
-        return [re.sub(r'//(.+)*', '', line) for line in lines]
-
-    def remove_empty_strings(self, vm_file) -> list:
-        lines = []
+    def tokenize(self, vm_file) -> list:
+        command_types = self.command_types
+        commands = []
         with open(vm_file, 'r') as f:
-            for line in f:
-                if line.strip():
-                    lines.append(line)
-        return lines
+            for number, line in enumerate(f, 1):
+                if '//' in line:
+                    line = line[:line.index('//')]
+                tokens = line.split()
+                if not tokens:
+                    continue
+
+                command_type = command_types.get(tokens[0])
+                if command_type == 'C_ARITHMETIC':
+                    args = (tokens[0],)
+                elif command_type in ('C_PUSH', 'C_POP', 'C_FUNCTION',
+                                      'C_CALL'):
+                    args = (tokens[1], int(tokens[2]))
+                elif command_type == 'C_RETURN':
+                    args = ()
+                else:
+                    args = tuple(tokens[1:2])
+                commands.append(Command(tokens[0], command_type, args,
+                                        number))
+        return commands
 
     def advance(self) -> None:
-        self.current_line = self.lines.pop()
+        self.current = self.commands[self.next_command]
+        self.current_line_number = self.current.line_number
+        self.next_command += 1
 
     def has_more_commands(self) -> bool:
-        return self.lines != []
+        return self.next_command < len(self.commands)
 
     def command_type(self):
-        if len(self.current_line) == 0:
-            return None
-        elif self.current_line.count(' ') < 1:
-            return self.command_types.get(self.current_line.rstrip())
-        else:
-            return self.command_types.get(self.current_line.split()[0])
+        return self.current.type
 
     def command_types_dict(self) -> dict:
         return {
@@ -73,14 +108,14 @@ class Parser:
 
     def command(self) -> str:
         # Returns vm command (e.g. push, pop, add, sub, etc.)
-        return self.current_line.split()[0]
+        return self.current.name
 
     def arg1(self) -> str:
         # Returns first argument of current command.
         # Should be called only if current command is
         # C_PUSH, C_POP, C_FUNCTION or C_CALL.
         # Should NOT be called if current command is C_RETURN.
-        return self.current_line.split()[1]
+        return self.current.args[0]
 
     def arg2(self) -> int:
-        return int(self.current_line.split()[2])
+        return self.current.args[1]
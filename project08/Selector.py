@@ -0,0 +1,133 @@
+class InstructionSelector:
+    """
+    Picks cheaper code for common windows of VM commands.
+
+    The CodeWriter write_* methods translate one command at a time, with
+    code that works for any segment and index. select() looks at a
+    command and the one after it and, if a pattern matches, writes
+    specialized code for the whole window instead:
+
+    move              push x; pop y, copied through D without the stack
+    push-true         push constant 0; not (or 1; neg) stores -1
+    push-0-1          push constant 0/1 stores M=0/M=1
+    push-small-index  push local/argument/this/that 0 or 1, A=M(+1)
+    push              other pushes, with the shorter stack push
+    pop-direct        pop static/temp/pointer without R13
+    pop-small-index   pop local/argument/this/that 0-6, A=M+1...
+    pop               other pops
+
+    Patterns are tried in this order. Only the code of the stack in RAM
+    is specialized; with cache_top the CodeWriter keeps pushed values in
+    D already. counts maps every pattern to [windows, instructions
+    saved], measured against what the write_* methods write for the
+    same commands.
+    """
+
+    PATTERNS = {  # name -> method writing the specialized code
+        'move': 'write_move',
+        'push-true': 'write_push_true',
+        'push-0-1': 'write_push_constant',
+        'push-small-index': 'write_push',
+        'push': 'write_push',
+        'pop-direct': 'write_pop',
+        'pop-small-index': 'write_pop',
+        'pop': 'write_pop',
+    }
+
+    INDEXED = ['local', 'argument', 'this', 'that']  # base in a pointer
+
+    def __init__(self, code_writer) -> None:
+        self.code_writer = code_writer
+        self.counts = {name: [0, 0] for name in self.PATTERNS}
+
+    def select(self, commands: list, position: int) -> int:
+        # Writes the window starting at commands[position] if a pattern
+        # matches. Returns the number of commands written, 0 if none.
+        command = commands[position]
+        following = None
+        if position + 1 < len(commands):
+            following = commands[position + 1]
+
+        if command.type == 'C_PUSH':
+            segment, index = command.args
+            if following is not None and following.type == 'C_POP':
+                return self.apply('move', [command, following])
+            if (segment == 'constant' and following is not None
+                    and following.type == 'C_ARITHMETIC'
+                    and (index, following.args[0]) in [(0, 'not'),
+                                                       (1, 'neg')]):
+                return self.apply('push-true', [command, following])
+            if segment == 'constant' and index in [0, 1]:
+                return self.apply('push-0-1', [command])
+            if segment in self.INDEXED and index <= 1:
+                return self.apply('push-small-index', [command])
+            return self.apply('push', [command])
+
+        if command.type == 'C_POP':
+            segment, index = command.args
+            if segment not in self.INDEXED:
+                return self.apply('pop-direct', [command])
+            if index <= 6:
+                return self.apply('pop-small-index', [command])
+            return self.apply('pop', [command])
+        return 0
+
+    def apply(self, name: str, window: list) -> int:
+        # Writes the generic code of window to measure it, then replaces
+        # it by the specialized code, keeping the '// command' comments
+        code_writer = self.code_writer
+        lines = code_writer.lines
+        start = len(lines)
+        for command in window:
+            if command.type == 'C_PUSH':
+                code_writer.write_push(*command.args)
+            elif command.type == 'C_POP':
+                code_writer.write_pop(*command.args)
+            else:
+                code_writer.write_arithmetic(*command.args)
+        generic = lines[start:]
+        del lines[start:]
+
+        code_writer.write_lines([line for line in generic
+                                 if line.startswith('//')])
+        code_start = len(lines)
+        getattr(self, self.PATTERNS[name])(window)
+        counts = self.counts[name]
+        counts[0] += 1
+        counts[1] += (count_instructions(generic)
+                      - count_instructions(lines[code_start:]))
+        return len(window)
+
+    def write_move(self, window: list) -> None:
+        push, pop = window
+        self.code_writer.load_segment_to_d(*push.args)
+        self.code_writer.store_d_to_segment(*pop.args)
+
+    def write_push_true(self, window: list) -> None:
+        self.code_writer.write_lines(['@SP', 'AM=M+1', 'A=A-1', 'M=-1'])
+
+    def write_push_constant(self, window: list) -> None:
+        index = window[0].args[1]
+        self.code_writer.write_lines(['@SP', 'AM=M+1', 'A=A-1',
+                                      f'M={index}'])
+
+    def write_push(self, window: list) -> None:
+        self.code_writer.load_segment_to_d(*window[0].args)
+        self.code_writer.write_lines(['@SP', 'AM=M+1', 'A=A-1', 'M=D'])
+
+    def write_pop(self, window: list) -> None:
+        self.code_writer.write_lines(['@SP', 'AM=M-1', 'D=M'])
+        self.code_writer.store_d_to_segment(*window[0].args)
+
+
+def count_instructions(lines: list) -> int:
+    # ROM words in lines, skipping blank lines, comments and labels
+    return sum(1 for line in lines if line and line[0] not in '/(')
+
+
+def merge_counts(total: dict, counts: dict) -> None:
+    # adds the counts of one InstructionSelector to total
+    for name, (windows, saved) in counts.items():
+        entry = total.setdefault(name, [0, 0])
+        entry[0] += windows
+        entry[1] += saved
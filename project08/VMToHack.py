@@ -0,0 +1,98 @@
+import argparse
+import sys
+from array import array
+from pathlib import Path
+import VMTranslator
+
+# the assembler lives in project06
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'project06'))
+import assembler  # noqa: E402
+from source_map import SourceMap  # noqa: E402
+from symbol_table import SymbolTable  # noqa: E402
+from writer import FORMATS  # noqa: E402
+
+
+def translate_and_assemble(input, output_format='hack', optimize=False,
+                           compact=False, jobs=1, cache=True,
+                           source_map=False, eliminate_dead=False,
+                           cache_top=False, short_labels=False,
+                           inline=0, select=False) -> tuple:
+    """
+    Translates .vm files and assembles the result in one process.
+
+    The CodeWriter output is passed to the assembler as a list of lines,
+    so no .asm file is written or read back. Labels from create_label
+    and write_call end up in a single SymbolTable together with the
+    variables, which is returned as the second value.
+
+    With source_map, <output>.map maps every ROM address to its .asm
+    line and .vm command (see project06/source_map.py).
+
+    With eliminate_dead, functions not reachable from Sys.init are
+    left out (directory mode). With short_labels, generated labels are
+    shortened and their readable names written to <output>.labels.
+    With inline > 0, calls to small non-recursive functions are
+    replaced by their bodies. With select, push and pop get the
+    cheaper code of InstructionSelector.
+    """
+    vm_translator = VMTranslator.translate_in_memory(
+        input, optimize, compact, jobs, cache, eliminate_dead, cache_top,
+        short_labels, inline, select)
+    code_writer = vm_translator.code_writer
+
+    symbol_table = SymbolTable()
+    line_numbers = array('i') if source_map else None
+    words = assembler.assemble(code_writer.lines, symbol_table, line_numbers)
+
+    extension, write = FORMATS[output_format]
+    output_path = Path(code_writer.out_file).with_suffix(extension)
+    write(str(output_path), words)
+    if source_map:
+        SourceMap.from_sources(code_writer.sources, line_numbers).save(
+            f'{output_path}.map')
+    if short_labels:
+        VMTranslator.write_label_names(code_writer,
+                                       output_path.with_suffix('.labels'))
+
+    return output_path, symbol_table
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Translates .vm files straight into Hack machine code.')
+    parser.add_argument('input', help='.vm file or directory of .vm files')
+    parser.add_argument('--format', default='hack', choices=list(FORMATS),
+                        help='output format (default: hack)')
+    parser.add_argument('--optimize', action='store_true',
+                        help='run the peephole optimizer')
+    parser.add_argument('--compact', action='store_true',
+                        help='share comparison and call/return routines')
+    parser.add_argument('--cache-top', action='store_true',
+                        help='keep the top of the stack in D')
+    parser.add_argument('--short-labels', action='store_true',
+                        help='name generated labels $0, $1, ...')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of translating processes')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not reuse cached translations')
+    parser.add_argument('--source-map', action='store_true',
+                        help='also write a source map next to the output')
+    parser.add_argument('--eliminate-dead', action='store_true',
+                        help='only translate functions reachable from '
+                             'Sys.init')
+    parser.add_argument('--inline', type=int, nargs='?', const=12,
+                        default=0, metavar='N',
+                        help='inline functions of at most N commands')
+    parser.add_argument('--select', action='store_true',
+                        help='use specialized push/pop code')
+    args = parser.parse_args()
+
+    translate_and_assemble(args.input, args.format, args.optimize,
+                           args.compact, args.jobs, not args.no_cache,
+                           args.source_map, args.eliminate_dead,
+                           args.cache_top, args.short_labels, args.inline,
+                           args.select)
+
+
+if __name__ == '__main__':
+    main()
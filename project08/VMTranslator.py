@@ -1,7 +1,12 @@
+import argparse
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import Parser
 import CodeWriter
+from Cache import TranslationCache
+from CallGraph import CallGraph
+from Selector import InstructionSelector, merge_counts
 
 
 class VMTranslator():
@@ -11,83 +16,404 @@ class VMTranslator():
         self.input_path_is_dir = None
         self.vm_files_count = 0
         self.asm_file = None
-        self.has_boostrap = False
         self.current_file = None
+        self.optimize = False
+        self.compact = False
+        self.cache_top = False
+        self.short_labels = False
+        self.select = False
+        self.selections = {}  # pattern -> [windows, instructions saved]
+        self.cache = None
+        self.call_graph = None
+        self.functions = None  # functions to emit, None for all
+        self.inline_functions = {}  # name -> InlineFunction
 
-    def set_input_output_files(self, vm_file) -> None:
-        self.parser = Parser.Parser(vm_file)
-
+    def set_output_file(self, vm_file) -> None:
         if self.input_path_is_dir:
             asm_file = self.asm_file.with_suffix('.asm')
         else:
             asm_file = vm_file.with_suffix('.asm')
 
-        self.code_writer = CodeWriter.CodeWriter(asm_file, self.current_file)
+        self.code_writer = CodeWriter.CodeWriter(
+            asm_file, optimize=self.optimize, compact=self.compact,
+            cache_top=self.cache_top, short_labels=self.short_labels)
+
+    def set_input_file(self, vm_file) -> None:
+        self.parser = Parser.Parser(vm_file)
+        self.code_writer.set_file_name(vm_file)
 
     def write_bootstrap(self) -> None:
         if self.input_path_is_dir and self.vm_files_count > 1:
             self.code_writer.write_bootstrap()
             self.code_writer.write_line('')
-            self.has_boostrap = True
+
+    def translate_files(self, vm_files, jobs=1) -> None:
+        # Translates every file into a separate chunk, reusing cached
+        # chunks, then appends the chunks in the order of vm_files
+        self.write_bootstrap()
+
+        chunks = {}
+        keys = {}
+        if self.cache is not None:
+            inline = inline_digest(self.inline_functions)
+            for file in vm_files:
+                keys[file] = self.cache.key(file, self.compact,
+                                            self.file_functions(file),
+                                            self.cache_top, inline,
+                                            self.select)
+                chunk = self.cache.get(keys[file])
+                if chunk is not None:
+                    chunks[file] = chunk
+
+        missing = [file for file in vm_files if file not in chunks]
+        asm_files = [self.code_writer.out_file] * len(missing)
+        compact = [self.compact] * len(missing)
+        functions = [self.functions] * len(missing)
+        cache_top = [self.cache_top] * len(missing)
+        inline_functions = [self.inline_functions] * len(missing)
+        select = [self.select] * len(missing)
+        if jobs > 1 and len(missing) > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                translated = list(executor.map(
+                    translate_file, missing, asm_files, compact, functions,
+                    cache_top, inline_functions, select))
+        else:
+            translated = map(translate_file, missing, asm_files, compact,
+                             functions, cache_top, inline_functions, select)
+
+        for file, chunk in zip(missing, translated):
+            chunks[file] = chunk
+            if self.cache is not None:
+                self.cache.put(keys[file], *chunk)
+
+        code_writer = self.code_writer
+        for file in vm_files:
+            lines, shared_routines, sources, selections = chunks[file]
+            merge_counts(self.selections, selections)
+            offset = len(code_writer.lines)
+            code_writer.sources.extend(
+                (offset + start, vm_file, vm_line, function)
+                for start, vm_file, vm_line, function in sources)
+            code_writer.lines.extend(lines)
+            code_writer.shared_routines |= shared_routines
+
+        if self.cache is not None:
+            self.cache.evict()
+
+    def file_functions(self, vm_file):
+        # the emitted functions defined in vm_file, None for all
+        if self.functions is None:
+            return None
+        return self.call_graph.functions_in(vm_file, self.functions)
+
+    def writers(self) -> dict:
+        # command type -> CodeWriter method taking the command's args
+        code_writer = self.code_writer
+        return {
+            'C_ARITHMETIC': code_writer.write_arithmetic,
+            'C_PUSH': code_writer.write_push,
+            'C_POP': code_writer.write_pop,
+            'C_LABEL': code_writer.write_label,
+            'C_IF': code_writer.write_if,
+            'C_GOTO': code_writer.write_goto,
+            'C_FUNCTION': code_writer.write_function,
+            'C_RETURN': code_writer.write_return,
+            'C_CALL': code_writer.write_call,
+        }
 
     def translate(self) -> None:
-        if not self.has_boostrap:
-            self.write_bootstrap()
-
-        while self.parser.has_more_commands():
-            self.parser.advance()
-            if self.parser.command_type() == 'C_ARITHMETIC':
-                self.code_writer.write_arithmetic(self.parser.command())
-            elif self.parser.command_type() == 'C_PUSH':
-                self.code_writer.write_push(
-                    self.parser.arg1(), self.parser.arg2())
-            elif self.parser.command_type() == 'C_POP':
-                self.code_writer.write_pop(
-                    self.parser.arg1(), self.parser.arg2())
-            elif self.parser.command_type() == 'C_LABEL':
-                self.code_writer.write_label(self.parser.arg1())
-            elif self.parser.command_type() == 'C_IF':
-                self.code_writer.write_if(self.parser.arg1())
-            elif self.parser.command_type() == 'C_GOTO':
-                self.code_writer.write_goto(self.parser.arg1())
-            elif self.parser.command_type() == 'C_FUNCTION':
-                self.code_writer.write_function(
-                    self.parser.arg1(), self.parser.arg2())
-            elif self.parser.command_type() == 'C_RETURN':
-                self.code_writer.write_return()
-            elif self.parser.command_type() == 'C_CALL':
-                self.code_writer.write_call(
-                    self.parser.arg1(), self.parser.arg2())
-            else:
+        code_writer = self.code_writer
+        writers = self.writers()
+        functions = self.functions
+        inline_functions = self.inline_functions
+        selector = None
+        if self.select and not code_writer.cache_top:
+            selector = InstructionSelector(code_writer)
+        commands = self.parser.commands
+        skipping = False  # inside a function that is not emitted
+        selected = 0  # commands left of a window written by the selector
+        for position, command in enumerate(commands):
+            if functions is not None and command.type == 'C_FUNCTION':
+                skipping = command.args[0] not in functions
+            if skipping:
+                continue
+            if selected:
+                selected -= 1
                 continue
 
-            self.code_writer.write_line('')
+            write = writers.get(command.type)
+            if write is None:
+                continue  # unknown command
+            start = len(code_writer.lines)
+            if selector is not None:
+                selected = selector.select(commands, position)
+            if selected:
+                selected -= 1  # the window is written
+            elif (command.type == 'C_CALL'
+                    and command.args[0] in inline_functions):
+                self.write_inline(inline_functions[command.args[0]],
+                                  command.args[1], writers)
+            else:
+                write(*command.args)
+            code_writer.add_source(start, command.line_number)
+            code_writer.write_line('')
+        code_writer.flush_stack_top()
+        if selector is not None:
+            self.selections = selector.counts
 
+    def write_inline(self, function, num_args: int, writers: dict) -> None:
+        # Writes the body of function (an InlineFunction) in place of a
+        # call, the calls in the body are not inlined again
+        code_writer = self.code_writer
+        code_writer.begin_inline(function, num_args)
+        for command, depth in zip(function.commands, function.depths):
+            code_writer.inline_depth = depth
+            writers[command.type](*command.args)
+        code_writer.end_inline()
 
-def main() -> None:
-    input = sys.argv[1]
-    file_path = Path(input)
-    input_is_dir = Path.is_dir(file_path)
 
-    if input_is_dir:
+def inline_digest(inline_functions: dict) -> str:
+    # Describes the inlined bodies for cache keys, as a change to an
+    # inlined function changes the code of its callers in other files
+    return repr(sorted(
+        (name, function.file_name, function.num_locals,
+         [(command.type, command.args) for command in function.commands])
+        for name, function in inline_functions.items()))
+
+
+def translate_file(vm_file, asm_file, compact=False, functions=None,
+                   cache_top=False, inline_functions=None,
+                   select=False) -> tuple:
+    # Translates a single .vm file into a list of assembly lines,
+    # leaving out functions not in functions (if given) and inlining
+    # the calls to inline_functions. Returns the lines, the shared
+    # routines they jump to, the source map entries (CodeWriter.sources)
+    # and the instruction selection counts.
+    vm_translator = VMTranslator()
+    vm_translator.compact = compact
+    vm_translator.functions = functions
+    vm_translator.inline_functions = inline_functions or {}
+    vm_translator.select = select
+    vm_translator.code_writer = CodeWriter.CodeWriter(
+        asm_file, compact=compact, cache_top=cache_top)
+    vm_translator.set_input_file(vm_file)
+    vm_translator.translate()
+
+    code_writer = vm_translator.code_writer
+    return (code_writer.lines, code_writer.shared_routines,
+            code_writer.sources, vm_translator.selections)
+
+
+def create_translator(file_path, vm_files, optimize=False,
+                      compact=False, cache_dir=None, cache_top=False,
+                      short_labels=False, select=False) -> VMTranslator:
+    vm_translator = VMTranslator()
+    vm_translator.input_path_is_dir = Path.is_dir(file_path)
+    vm_translator.vm_files_count = len(vm_files)
+    vm_translator.optimize = optimize
+    vm_translator.compact = compact
+    vm_translator.cache_top = cache_top
+    vm_translator.short_labels = short_labels
+    vm_translator.select = select
+    if cache_dir is not None:
+        vm_translator.cache = TranslationCache(cache_dir)
+
+    child_path = file_path.joinpath(f'{file_path.stem}')
+    vm_translator.asm_file = child_path
+
+    vm_translator.set_output_file(file_path)
+    return vm_translator
+
+
+def find_vm_files(file_path: Path) -> list:
+    if Path.is_dir(file_path):
         vm_files = []
         for f in Path.iterdir(file_path):
             if f.name.endswith('.vm'):
                 vm_files.append(f)
+        vm_files.sort()
     else:
         vm_files = [file_path]
 
-    vm_translator = VMTranslator()
-    vm_translator.input_path_is_dir = input_is_dir
-    vm_translator.vm_files_count = len(vm_files)
+    return vm_files
 
-    child_path = file_path.joinpath(f'{file_path.stem}')
-    vm_translator.asm_file = child_path
 
-    for file in vm_files:
-        vm_translator.current_file = file
-        vm_translator.set_input_output_files(file)
-        vm_translator.translate()
+def translate_in_memory(input, optimize=False, compact=False, jobs=1,
+                        cache=True, eliminate_dead=False,
+                        cache_top=False, short_labels=False,
+                        inline=0, select=False) -> VMTranslator:
+    # Translates without writing the output file. The assembly lines
+    # are left in the returned translator's code_writer.lines.
+    # With eliminate_dead, only functions reachable from Sys.init are
+    # translated (directory mode, a single file is translated whole).
+    # With inline > 0, calls to non-recursive functions of at most
+    # inline commands are replaced by their bodies. With select, push
+    # and pop get the cheaper code of InstructionSelector.
+    file_path = Path(input)
+    vm_files = find_vm_files(file_path)
+
+    cache_dir = None
+    if cache:
+        base_dir = file_path if Path.is_dir(file_path) else file_path.parent
+        cache_dir = base_dir.joinpath('.vm_cache')
+
+    vm_translator = create_translator(
+        file_path, vm_files, optimize, compact, cache_dir, cache_top,
+        short_labels, select)
+    eliminate_dead = eliminate_dead and Path.is_dir(file_path)
+    if eliminate_dead or inline:
+        call_graph = CallGraph(vm_files)
+        vm_translator.call_graph = call_graph
+        if inline:
+            vm_translator.inline_functions = call_graph.inlinable(inline)
+        if eliminate_dead:
+            vm_translator.functions = call_graph.reachable(
+                inlined=vm_translator.inline_functions)
+    vm_translator.translate_files(vm_files, jobs)
+    vm_translator.code_writer.finish()
+    return vm_translator
+
+
+def write_source_map(code_writer) -> Path:
+    # Writes <output>.asm.map, mapping .asm lines to .vm lines and
+    # functions. The assembler picks it up with --source-map.
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent
+                           / 'project06'))
+    from source_map import SourceMap
+
+    out_file = Path(code_writer.out_file)
+    map_file = out_file.with_name(out_file.name + '.map')
+    SourceMap.from_sources(code_writer.sources).save(map_file)
+    return map_file
+
+
+def write_label_names(code_writer, path) -> None:
+    # Writes the short label side table, one 'short readable' pair per
+    # line, for reading the output of short_labels mode
+    with open(path, 'w') as f:
+        for short, name in code_writer.label_names.items():
+            f.write(f'{short} {name}\n')
+
+
+def translate_path(input, optimize=False, compact=False, jobs=1,
+                   cache=True, source_map=False, eliminate_dead=False,
+                   cache_top=False, short_labels=False,
+                   inline=0, select=False, footprint=False) -> Path:
+    vm_translator = translate_in_memory(input, optimize, compact, jobs, cache,
+                                        eliminate_dead, cache_top,
+                                        short_labels, inline, select)
+    vm_translator.code_writer.close()
+    if source_map:
+        write_source_map(vm_translator.code_writer)
+    if short_labels:
+        labels_file = Path(vm_translator.code_writer.out_file).with_suffix(
+            '.labels')
+        write_label_names(vm_translator.code_writer, labels_file)
+        print(f'Shortened {len(vm_translator.code_writer.label_names)} '
+              f'labels, names in {labels_file}.')
+
+    cache = vm_translator.cache
+    if cache is not None:
+        print(f'Translation cache: {cache.hits} hits, {cache.misses} '
+              f'misses.')
+
+    if select:
+        selections = vm_translator.selections
+        saved = sum(saved for _, saved in selections.values())
+        print(f'Instruction selection saved {saved} instructions.')
+        for name, (windows, saved) in selections.items():
+            print(f'  {name}: {windows} windows, {saved} instructions')
+
+    optimizer = vm_translator.code_writer.optimizer
+    if optimizer is not None:
+        print(f'Optimizer removed {optimizer.removed} of '
+              f'{optimizer.instructions_before} instructions.')
+        for name, count in optimizer.rule_counts.items():
+            print(f'  {name}: {count}')
+
+    if compact and footprint:
+        # translate again with inlined routines and otherwise the same
+        # settings, without writing the output or caching it
+        inline_translator = translate_in_memory(
+            input, optimize, False, jobs, False, eliminate_dead, cache_top,
+            short_labels, inline, select)
+
+        compact_size = vm_translator.code_writer.instruction_count()
+        inline_size = inline_translator.code_writer.instruction_count()
+        print(f'ROM footprint: {compact_size} instructions compact, '
+              f'{inline_size} inline '
+              f'({inline_size - compact_size} saved).')
+
+    if vm_translator.functions is not None:
+        # translate again with every function, without writing the output
+        full_translator = translate_in_memory(input, optimize, compact, jobs,
+                                              cache, cache_top=cache_top,
+                                              short_labels=short_labels,
+                                              inline=inline, select=select)
+        all_functions = len(vm_translator.call_graph.files)
+        live_functions = len(vm_translator.functions)
+        size = vm_translator.code_writer.instruction_count()
+        full_size = full_translator.code_writer.instruction_count()
+        print(f'Dead-function elimination removed '
+              f'{all_functions - live_functions} of {all_functions} '
+              f'functions ({full_size - size} of {full_size} instructions).')
+
+    if inline:
+        inlined = vm_translator.inline_functions
+        print(f'Inlined {len(inlined)} functions of at most {inline} '
+              f'commands: {", ".join(sorted(inlined)) or "none"}.')
+
+    return vm_translator.code_writer.out_file
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Translates .vm files into Hack assembly.')
+    parser.add_argument('input', help='.vm file or directory of .vm files')
+    parser.add_argument('--optimize', action='store_true',
+                        help='run the peephole optimizer on the output')
+    parser.add_argument('--compact', action='store_true',
+                        help='share comparison and call/return routines '
+                             'instead of inlining them')
+    parser.add_argument('--footprint', action='store_true',
+                        help='with --compact, also translate without it '
+                             'and report the ROM saved')
+    parser.add_argument('--cache-top', action='store_true',
+                        help='keep the top of the stack in D across '
+                             'straight-line code')
+    parser.add_argument('--short-labels', action='store_true',
+                        help='name return and comparison labels $0, $1, ... '
+                             'and write the readable names to Prog.labels')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of processes translating files '
+                             'in parallel (directory mode)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='retranslate every file instead of reusing '
+                             'fragments cached in .vm_cache')
+    parser.add_argument('--source-map', action='store_true',
+                        help='also write Prog.asm.map, mapping .asm lines '
+                             'to .vm lines')
+    parser.add_argument('--eliminate-dead', action='store_true',
+                        help='only translate functions reachable from '
+                             'Sys.init (directory mode)')
+    parser.add_argument('--inline', type=int, nargs='?', const=12,
+                        default=0, metavar='N',
+                        help='replace calls to non-recursive functions of '
+                             'at most N commands (default 12) by their '
+                             'bodies')
+    parser.add_argument('--select', action='store_true',
+                        help='use specialized code for small indices, '
+                             'constants 0/1/-1 and push/pop moves '
+                             '(no effect with --cache-top)')
+    args = parser.parse_args()
+
+    translate_path(args.input, optimize=args.optimize, compact=args.compact,
+                   jobs=args.jobs, cache=not args.no_cache,
+                   source_map=args.source_map,
+                   eliminate_dead=args.eliminate_dead,
+                   cache_top=args.cache_top,
+                   short_labels=args.short_labels, inline=args.inline,
+                   select=args.select, footprint=args.footprint)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,473 @@
+import builtins
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+import Parser
+import VMTranslator
+
+
+# Recursive Fibonacci, used to benchmark execution of translated code
+FIBONACCI_PROGRAM = {
+    'Main.vm': """
+function Main.fibonacci 0
+push argument 0
+push constant 2
+lt
+if-goto IF_TRUE
+goto IF_FALSE
+label IF_TRUE
+push argument 0
+return
+label IF_FALSE
+push argument 0
+push constant 2
+sub
+call Main.fibonacci 1
+push argument 0
+push constant 1
+sub
+call Main.fibonacci 1
+add
+return
+""",
+    'Sys.vm': """
+function Sys.init 0
+push constant {n}
+call Main.fibonacci 1
+pop static 0
+label WHILE
+goto WHILE
+""",
+}
+
+# Sum of squares with a shift-and-add Math.multiply, written the way
+# the Jack compiler translates loops and conditionals
+SUM_OF_SQUARES_PROGRAM = {
+    'Math.vm': """
+function Math.multiply 3
+push constant 0
+pop local 0
+push argument 0
+pop local 1
+push constant 1
+pop local 2
+label WHILE_EXP0
+push local 2
+push constant 0
+eq
+not
+not
+if-goto WHILE_END0
+push argument 1
+push local 2
+and
+push constant 0
+eq
+not
+if-goto IF_TRUE0
+goto IF_FALSE0
+label IF_TRUE0
+push local 0
+push local 1
+add
+pop local 0
+label IF_FALSE0
+push local 1
+push local 1
+add
+pop local 1
+push local 2
+push local 2
+add
+pop local 2
+goto WHILE_EXP0
+label WHILE_END0
+push local 0
+return
+""",
+    'Main.vm': """
+function Main.main 2
+push constant 0
+pop local 0
+push constant 0
+pop local 1
+label WHILE_EXP0
+push local 0
+push constant {n}
+lt
+not
+if-goto WHILE_END0
+push local 1
+push local 0
+push local 0
+call Math.multiply 2
+add
+pop local 1
+push local 0
+push constant 1
+add
+pop local 0
+goto WHILE_EXP0
+label WHILE_END0
+push local 1
+pop static 0
+push constant 0
+return
+""",
+    'Sys.vm': """
+function Sys.init 0
+call Main.main 0
+pop temp 0
+label WHILE
+goto WHILE
+""",
+}
+
+# Object code the way the Jack compiler writes it: a constructor and
+# getters that set THIS from their argument, called in a loop
+POINTS_PROGRAM = {
+    'Main.vm': """
+function Main.main 2
+label WHILE_EXP0
+push local 0
+push constant {n}
+lt
+not
+if-goto WHILE_END0
+push local 0
+push local 0
+push local 0
+add
+call Point.new 2
+pop local 1
+push static 0
+push local 1
+call Point.getX 1
+add
+push local 1
+call Point.getY 1
+add
+pop static 0
+push local 0
+push constant 1
+add
+pop local 0
+goto WHILE_EXP0
+label WHILE_END0
+push constant 0
+return
+""",
+    'Point.vm': """
+function Point.new 0
+push constant 2048
+pop pointer 0
+push argument 0
+pop this 0
+push argument 1
+pop this 1
+push pointer 0
+return
+function Point.getX 0
+push argument 0
+pop pointer 0
+push this 0
+return
+function Point.getY 0
+push argument 0
+pop pointer 0
+push this 1
+return
+""",
+    'Sys.vm': """
+function Sys.init 0
+call Main.main 0
+pop temp 0
+label WHILE
+goto WHILE
+""",
+}
+
+ARITHMETIC = ['add', 'sub', 'neg', 'eq', 'gt', 'lt', 'and', 'or', 'not']
+SEGMENTS = ['local', 'argument', 'this', 'that', 'static', 'temp', 'pointer']
+
+
+def generate_corpus(directory, num_files: int = 50,
+                    functions_per_file: int = 40,
+                    commands_per_function: int = 60,
+                    seed: int = 0) -> Path:
+    """
+    Writes a synthetic multi-file VM program to directory.
+    Every file defines functions_per_file functions which mix
+    push/pop, arithmetic, branching and calls to other functions.
+    """
+    rng = random.Random(seed)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    names = [f'Class{i}' for i in range(num_files)]
+    functions = [f'{name}.f{j}' for name in names
+                 for j in range(functions_per_file)]
+
+    for name in names:
+        lines = []
+        for j in range(functions_per_file):
+            lines.append(f'function {name}.f{j} 2')
+            for k in range(commands_per_function):
+                choice = rng.random()
+                if choice < 0.35:
+                    segment = rng.choice(SEGMENTS)
+                    index = rng.randrange(2 if segment == 'pointer' else 8)
+                    lines.append(f'push {segment} {index}')
+                elif choice < 0.45:
+                    lines.append(f'push constant {rng.randrange(32768)}')
+                elif choice < 0.6:
+                    segment = rng.choice(SEGMENTS)
+                    index = rng.randrange(2 if segment == 'pointer' else 8)
+                    lines.append(f'pop {segment} {index}')
+                elif choice < 0.85:
+                    lines.append(rng.choice(ARITHMETIC))
+                elif choice < 0.92:
+                    lines.append(f'call {rng.choice(functions)} '
+                                 f'{rng.randrange(3)}')
+                else:
+                    lines.append(f'label L{k}')
+                    lines.append(f'if-goto L{k}')
+                    lines.append(f'goto L{k}')
+            lines.append('push constant 0')
+            lines.append('return')
+        (directory / f'{name}.vm').write_text('\n'.join(lines) + '\n')
+
+    return directory
+
+
+def count_opens(function, *args, **kwargs):
+    # Runs function(*args, **kwargs) and counts the files it opens
+    opens = 0
+    real_open = builtins.open
+
+    def counting_open(*open_args, **open_kwargs):
+        nonlocal opens
+        opens += 1
+        return real_open(*open_args, **open_kwargs)
+
+    builtins.open = counting_open
+    try:
+        start = time.perf_counter()
+        function(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+    finally:
+        builtins.open = real_open
+
+    return opens, elapsed
+
+
+def benchmark_parsing(directory) -> None:
+    # VM commands per second through the Parser alone and through the
+    # whole translator (without writing the output)
+    vm_files = VMTranslator.find_vm_files(Path(directory))
+    start = time.perf_counter()
+    commands = 0
+    for vm_file in vm_files:
+        commands += len(Parser.Parser(vm_file).commands)
+    parsing = time.perf_counter() - start
+
+    start = time.perf_counter()
+    VMTranslator.translate_in_memory(directory, cache=False)
+    translation = time.perf_counter() - start
+    print(f'{commands:,} commands: parsing {commands / parsing:,.0f} '
+          f'commands/s, translation {commands / translation:,.0f} commands/s')
+
+
+def benchmark_translation(directory) -> None:
+    opens, elapsed = count_opens(
+        VMTranslator.translate_path, directory, cache=False)
+    vm_files = len(list(Path(directory).glob('*.vm')))
+    print(f'translated {vm_files} .vm files in {elapsed:.3f}s, '
+          f'{opens} open() calls')
+
+
+def benchmark_parallel(directory, jobs: int) -> None:
+    for n in [1, jobs]:
+        start = time.perf_counter()
+        VMTranslator.translate_path(directory, jobs=n, cache=False)
+        elapsed = time.perf_counter() - start
+        print(f'jobs={n}: {elapsed:.3f}s')
+
+
+def benchmark_incremental(directory) -> None:
+    def timed(label, **kwargs):
+        start = time.perf_counter()
+        VMTranslator.translate_path(directory, **kwargs)
+        print(f'{label}: {time.perf_counter() - start:.3f}s')
+
+    timed('no cache', cache=False)
+    timed('cold cache')
+    timed('warm cache')
+    changed = next(Path(directory).glob('*.vm'))
+    changed.write_text(changed.read_text() + 'push constant 1\n')
+    timed('one file changed')
+
+
+def write_program(directory, program: dict, n: int) -> Path:
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, source in program.items():
+        (directory / name).write_text(source.replace('{n}', str(n)))
+    return directory
+
+
+def write_fibonacci(directory, n: int = 18) -> Path:
+    return write_program(directory, FIBONACCI_PROGRAM, n)
+
+
+def write_sum_of_squares(directory, n: int = 100) -> Path:
+    return write_program(directory, SUM_OF_SQUARES_PROGRAM, n)
+
+
+def write_points(directory, n: int = 100) -> Path:
+    return write_program(directory, POINTS_PROGRAM, n)
+
+
+def benchmark_emulator(directory) -> None:
+    # Runs a translated VM program in the interpreting and the
+    # block-compiling Hack emulator
+    import VMToHack
+    from block_emulator import BlockEmulator
+    from emulator import Emulator, load_hack
+
+    output_path, symbol_table = VMToHack.translate_and_assemble(
+        directory, cache=False)
+    words = load_hack(str(output_path))
+    engines = [
+        ('interpreted', Emulator(words)),
+        ('compiled', BlockEmulator(words, symbol_table.labels.values())),
+    ]
+    for engine, emulator in engines:
+        start = time.perf_counter()
+        emulator.run(100_000_000)
+        elapsed = time.perf_counter() - start
+        print(f'{Path(directory).name} ({engine}): '
+              f'{emulator.cycles:,} cycles, '
+              f'{emulator.cycles / elapsed:,.0f} cycles/s')
+
+
+def benchmark_short_labels(directory) -> None:
+    # .asm size, assembler peak memory and assembly time with the
+    # generated labels and with short labels
+    import tracemalloc
+    import VMToHack  # puts project06 on the path
+    assemble = VMToHack.assembler.assemble
+
+    for short_labels in [False, True]:
+        out_file = Path(VMTranslator.translate_path(
+            directory, cache=False, short_labels=short_labels))
+        lines = out_file.read_text().splitlines()
+
+        start = time.perf_counter()
+        assemble(lines)
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        assemble(lines)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f'short_labels={short_labels}: '
+              f'{out_file.stat().st_size / 1024:,.0f} KiB .asm, '
+              f'assembler peak {peak / 1024:,.0f} KiB, '
+              f'assembled in {elapsed:.3f}s')
+
+
+def benchmark_stack_top(directories) -> None:
+    # Executed cycles and ROM size with and without keeping the top
+    # of the stack in D
+    import VMToHack
+    from emulator import Emulator, load_hack
+
+    for directory in directories:
+        results = {}
+        for cache_top in [False, True]:
+            output_path, _ = VMToHack.translate_and_assemble(
+                directory, cache=False, cache_top=cache_top)
+            emulator = Emulator(load_hack(str(output_path)))
+            emulator.run(100_000_000)
+            results[cache_top] = emulator.cycles
+            print(f'{Path(directory).name} (cache_top={cache_top}): '
+                  f'{len(emulator.program)} instructions, '
+                  f'{emulator.cycles:,} cycles, result {emulator.ram[16]}')
+        print(f'{Path(directory).name}: '
+              f'{1 - results[True] / results[False]:.1%} fewer cycles')
+
+
+def benchmark_inlining(directories, max_size: int = 12) -> None:
+    # Executed cycles and ROM size with and without inlining the
+    # functions of at most max_size commands
+    import VMToHack
+    from emulator import Emulator, load_hack
+
+    for directory in directories:
+        results = {}
+        for inline in [0, max_size]:
+            output_path, _ = VMToHack.translate_and_assemble(
+                directory, cache=False, inline=inline)
+            emulator = Emulator(load_hack(str(output_path)))
+            emulator.run(100_000_000)
+            results[inline] = emulator.cycles
+            print(f'{Path(directory).name} (inline={inline}): '
+                  f'{len(emulator.program)} instructions, '
+                  f'{emulator.cycles:,} cycles, result {emulator.ram[16]}')
+        print(f'{Path(directory).name}: '
+              f'{1 - results[max_size] / results[0]:.1%} fewer cycles')
+
+
+def benchmark_selection(directories, corpus) -> None:
+    # ROM size and executed cycles with and without the instruction
+    # selector, and what each of its patterns saved on corpus
+    import VMToHack
+    from emulator import Emulator, load_hack
+
+    for directory in directories:
+        results = {}
+        for select in [False, True]:
+            output_path, _ = VMToHack.translate_and_assemble(
+                directory, cache=False, select=select)
+            emulator = Emulator(load_hack(str(output_path)))
+            emulator.run(100_000_000)
+            results[select] = (len(emulator.program), emulator.cycles)
+            print(f'{Path(directory).name} (select={select}): '
+                  f'{len(emulator.program)} instructions, '
+                  f'{emulator.cycles:,} cycles, result {emulator.ram[16]}')
+        print(f'{Path(directory).name}: '
+              f'{1 - results[True][0] / results[False][0]:.1%} smaller, '
+              f'{1 - results[True][1] / results[False][1]:.1%} fewer cycles')
+
+    vm_translator = VMTranslator.translate_in_memory(
+        corpus, cache=False, select=True)
+    print(f'{Path(corpus).name}:')
+    for name, (windows, saved) in vm_translator.selections.items():
+        print(f'  {name}: {windows} windows, {saved} instructions saved')
+
+
+def main() -> None:
+    jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = generate_corpus(Path(tmp) / 'Corpus')
+        benchmark_parsing(directory)
+        benchmark_translation(directory)
+        benchmark_parallel(directory, jobs)
+        benchmark_incremental(directory)
+        benchmark_short_labels(directory)
+        benchmark_emulator(write_fibonacci(Path(tmp) / 'Fibonacci'))
+        benchmark_stack_top([write_fibonacci(Path(tmp) / 'Fibonacci'),
+                             write_sum_of_squares(Path(tmp) / 'Squares')])
+        benchmark_inlining([write_points(Path(tmp) / 'Points'),
+                            write_sum_of_squares(Path(tmp) / 'Squares')])
+        benchmark_selection([write_fibonacci(Path(tmp) / 'Fibonacci'),
+                             write_sum_of_squares(Path(tmp) / 'Squares'),
+                             write_points(Path(tmp) / 'Points')],
+                            directory)
+
+
+if __name__ == '__main__':
+    main()